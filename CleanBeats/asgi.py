@@ -2,6 +2,10 @@
 ASGI config for CleanBeats project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+This is the entry point to deploy: the event-stream endpoints (map geo,
+analytics scan) only release their worker between events under ASGI, e.g.
+
+    uvicorn CleanBeats.asgi:application --workers 4
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
@@ -52,8 +52,10 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'accounts.spotify.SpotifyContextMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'accounts.admission.AdmissionControlMiddleware',
 ]
 
 ROOT_URLCONF = 'CleanBeats.urls'
@@ -75,18 +77,50 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'CleanBeats.wsgi.application'
+# What production runs: streamed responses only free their worker under ASGI
+ASGI_APPLICATION = 'CleanBeats.asgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# Production profile: WAL, synchronous=NORMAL, a busy timeout and BEGIN
+# IMMEDIATE on every connection, plus persistent connections.
+# SQLITE_PRODUCTION=0 restores stock settings. transaction_mode and
+# init_command are Django 5.1 OPTIONS; accounts.sqlite backports them to 5.0
+# (see accounts/sqlite/base.py).
+SQLITE_PRODUCTION = os.getenv("SQLITE_PRODUCTION", "1") == "1"
+# How long a writer waits for the database lock (seconds)
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", 20))
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'accounts.sqlite' if SQLITE_PRODUCTION else 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': int(os.getenv("DB_CONN_MAX_AGE", 600)) if SQLITE_PRODUCTION else 0,
+        'CONN_HEALTH_CHECKS': SQLITE_PRODUCTION,
+        'OPTIONS': {
+            'timeout': SQLITE_BUSY_TIMEOUT,
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL',
+        } if SQLITE_PRODUCTION else {},
     }
 }
 
+# Optional read replica for reporting reads: analytics, exports and admin
+# listings (accounts/replica.py). Locally, point it at a copy of db.sqlite3.
+DATABASE_REPLICA_NAME = os.getenv("DATABASE_REPLICA_NAME", "")
+if DATABASE_REPLICA_NAME:
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': DATABASE_REPLICA_NAME,
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['accounts.replica.ReplicaRouter']
+# How long a user's reporting reads stay on the primary after they change a
+# decision, covering replica lag (seconds)
+REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", 30))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -140,4 +174,95 @@ load_dotenv()
 
 SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
-SPOTIFY_REDIRECT_URI = os.getenv("SPOTIFY_REDIRECT_URI")
\ No newline at end of file
+SPOTIFY_REDIRECT_URI = os.getenv("SPOTIFY_REDIRECT_URI")
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Set REDIS_URL to share the cache between workers; CACHE_DIR selects a
+# file-based cache for single-node deployments. Defaults to local memory.
+
+REDIS_URL = os.getenv("REDIS_URL")
+CACHE_DIR = os.getenv("CACHE_DIR")
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'cleanbeats',
+        }
+    }
+elif CACHE_DIR:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': CACHE_DIR,
+            'KEY_PREFIX': 'cleanbeats',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'cleanbeats',
+        }
+    }
+
+# How long a user's playlist list and Spotify profile stay cached (seconds);
+# see accounts/cache.py for every cached resource
+SPOTIFY_PLAYLISTS_CACHE_TIMEOUT = int(os.getenv("SPOTIFY_PLAYLISTS_CACHE_TIMEOUT", 60 * 5))
+SPOTIFY_PROFILE_CACHE_TIMEOUT = int(os.getenv("SPOTIFY_PROFILE_CACHE_TIMEOUT", 60 * 60))
+SPOTIFY_CONNECTED_CACHE_TIMEOUT = int(os.getenv("SPOTIFY_CONNECTED_CACHE_TIMEOUT", 60 * 60))
+
+# Spotify resources are served stale for this long past their TTL while they
+# refresh in the background, or while Spotify rate-limits us (seconds)
+SPOTIFY_STALE_TIMEOUT = int(os.getenv("SPOTIFY_STALE_TIMEOUT", 60 * 60 * 24))
+# Minimum spacing between failed background refreshes of one entry (seconds)
+CACHE_REFRESH_RETRY_TIMEOUT = int(os.getenv("CACHE_REFRESH_RETRY_TIMEOUT", 60))
+# Timeout for each Spotify API request (seconds)
+SPOTIFY_REQUEST_TIMEOUT = int(os.getenv("SPOTIFY_REQUEST_TIMEOUT", 10))
+
+# Per-worker budget for Spotify API calls: refill rate (calls per second),
+# bucket size, and the tokens each priority class leaves to the ones above it.
+# Checked at startup (accounts.dispatch.check_settings)
+SPOTIFY_RATE_LIMIT = float(os.getenv("SPOTIFY_RATE_LIMIT", 5))
+SPOTIFY_RATE_BURST = int(os.getenv("SPOTIFY_RATE_BURST", 20))
+SPOTIFY_INTERACTIVE_RESERVE = int(os.getenv("SPOTIFY_INTERACTIVE_RESERVE", 5))
+
+# Per-worker LRU in front of the shared cache: byte budget and entry lifetime
+LOCAL_CACHE_MAX_BYTES = int(os.getenv("LOCAL_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+LOCAL_CACHE_TIMEOUT = int(os.getenv("LOCAL_CACHE_TIMEOUT", 30))
+
+# Coalescing of identical concurrent Spotify calls (seconds): how long
+# waiters wait for the in-flight call, how long a leader may hold the shared
+# lock, and how long an uncached result stays readable by other workers
+COALESCE_WAIT_TIMEOUT = int(os.getenv("COALESCE_WAIT_TIMEOUT", 15))
+COALESCE_LOCK_TIMEOUT = int(os.getenv("COALESCE_LOCK_TIMEOUT", 30))
+COALESCE_RESULT_TIMEOUT = int(os.getenv("COALESCE_RESULT_TIMEOUT", 10))
+
+# How long computed analytics stay cached (seconds)
+ANALYTICS_CACHE_TIMEOUT = int(os.getenv("ANALYTICS_CACHE_TIMEOUT", 60 * 60 * 24))
+
+# How long playlist tracks stay cached per (playlist, snapshot_id) (seconds)
+PLAYLIST_SNAPSHOT_CACHE_TIMEOUT = int(os.getenv("PLAYLIST_SNAPSHOT_CACHE_TIMEOUT", 60 * 60 * 24 * 7))
+
+# Parallel playlist downloads for the library-wide map
+GEO_LIBRARY_WORKERS = int(os.getenv("GEO_LIBRARY_WORKERS", 4))
+
+# Least time between two partial results streamed to a loading map or
+# analytics page (seconds)
+STREAM_PROGRESS_INTERVAL = float(os.getenv("STREAM_PROGRESS_INTERVAL", 1))
+
+# Country charts are shared by all users; how long to keep them (seconds)
+CHART_CACHE_TIMEOUT = int(os.getenv("CHART_CACHE_TIMEOUT", 60 * 60))
+CHART_BATCH_WORKERS = int(os.getenv("CHART_BATCH_WORKERS", 4))
+CHART_BATCH_MAX_COUNTRIES = 100
+
+# Admission control for heavy endpoints: concurrent requests allowed per user
+# and across all workers, how long a leaked slot lives (seconds), and the
+# Retry-After sent with 503s (seconds)
+ADMISSION_USER_CONCURRENCY = int(os.getenv("ADMISSION_USER_CONCURRENCY", 2))
+ADMISSION_GLOBAL_CONCURRENCY = int(os.getenv("ADMISSION_GLOBAL_CONCURRENCY", 8))
+ADMISSION_SLOT_TIMEOUT = int(os.getenv("ADMISSION_SLOT_TIMEOUT", 60 * 10))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", 5))
@@ -0,0 +1,125 @@
+"""Admission control for heavy endpoints.
+
+Views marked with ``@heavy`` (library scans, exports, many-country chart
+lookups) may only run ADMISSION_USER_CONCURRENCY at a time per user and
+ADMISSION_GLOBAL_CONCURRENCY at a time across all workers. Requests over
+either cap, or arriving while Spotify has rate-limited this worker, are turned
+away with a fast 503 and Retry-After instead of queueing behind the work
+already in flight, so one user can't tie up every worker.
+
+Slots are individual keys in the shared cache taken with ``cache.add``, so a
+worker that dies mid-request only leaks its slot until ADMISSION_SLOT_TIMEOUT.
+Streamed responses hold their slot until the stream is closed.
+"""
+import math
+from functools import wraps
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpRequest, HttpResponse, JsonResponse
+
+from .dispatch import dispatcher
+
+
+def heavy(view_func=None, *, unless: Optional[Callable[[HttpRequest], bool]] = None):
+    """Mark a view as subject to admission control.
+
+    ``unless(request)`` exempts requests that do none of the heavy work, such
+    as cache-only reads: ``@heavy(unless=lambda request: ...)``.
+    """
+    if view_func is None:
+        return lambda view_func: heavy(view_func, unless=unless)
+
+    @wraps(view_func)
+    def wrapped(*args, **kwargs):
+        return view_func(*args, **kwargs)
+    wrapped.admission_heavy = True
+    wrapped.admission_exempt = unless
+    return wrapped
+
+
+def _take_slot(scope: str, limit: int) -> Optional[str]:
+    """Take one of ``limit`` slots in ``scope``; returns its key or None when all are taken."""
+    for i in range(limit):
+        key = f"admission:{scope}:{i}"
+        if cache.add(key, 1, settings.ADMISSION_SLOT_TIMEOUT):
+            return key
+    return None
+
+
+def _busy(request, retry_after: float, reason: str) -> HttpResponse:
+    message = f"{reason}. Please try again in a few seconds."
+    if '/api/' in request.path:
+        response = JsonResponse({"error": message}, status=503)
+    else:
+        response = HttpResponse(message, status=503, content_type='text/plain')
+    response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+class _Releasing:
+    """Streamed body that releases the slots when the response is closed.
+
+    The server closes the response once the body is sent, and also when the
+    client disconnects before the stream has even started.
+    """
+
+    def __init__(self, content, release):
+        self._content = content
+        self._release = release
+
+    def __iter__(self):
+        return iter(self._content)
+
+    def close(self):
+        self._release()
+
+
+class _AsyncReleasing(_Releasing):
+    def __aiter__(self):
+        return self._content.__aiter__()
+
+
+def _release_when_done(response, release):
+    wrapper = _AsyncReleasing if response.is_async else _Releasing
+    response.streaming_content = wrapper(response.streaming_content, release)
+
+
+class AdmissionControlMiddleware:
+    """Enforce per-user and global concurrency caps on ``@heavy`` views."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        release = getattr(request, '_admission_release', None)
+        if release is not None:
+            if getattr(response, 'streaming', False):
+                _release_when_done(response, release)
+            else:
+                release()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not getattr(view_func, 'admission_heavy', False) or not request.user.is_authenticated:
+            return None
+        exempt = getattr(view_func, 'admission_exempt', None)
+        if exempt is not None and exempt(request):
+            return None
+
+        paused_for = dispatcher.paused_for()
+        if paused_for > 0:
+            return _busy(request, paused_for, "Spotify is rate limiting us right now")
+
+        user_slot = _take_slot(f"user:{request.user.pk}", settings.ADMISSION_USER_CONCURRENCY)
+        if user_slot is None:
+            return _busy(request, settings.ADMISSION_RETRY_AFTER, "You already have heavy requests running")
+        global_slot = _take_slot("global", settings.ADMISSION_GLOBAL_CONCURRENCY)
+        if global_slot is None:
+            cache.delete(user_slot)
+            return _busy(request, settings.ADMISSION_RETRY_AFTER, "The server is busy")
+
+        request._admission_release = lambda: cache.delete_many([user_slot, global_slot])
+        return None
@@ -0,0 +1,426 @@
+"""Namespaced, versioned caching for Spotify-derived data.
+
+Every cached resource (playlists, playlist tracks, profiles, charts, geo
+payloads...) is a :class:`ResourceCache` with its own namespace and TTL setting,
+stored in Django's default cache (Redis, file or local memory, see CACHES in
+settings). Keys look like::
+
+    <namespace>:v<version>:<user id or "-">:<part>:<part>...
+
+Per-user resources embed the user id; shared ones (charts, anything keyed by a
+playlist snapshot) do not. ``invalidate()`` bumps the namespace version (per
+user for per-user resources), which orphans every existing key at once; the
+orphans simply expire. Hits and misses are counted per namespace in-process.
+
+In front of the shared cache each worker keeps a small LRU of recently used
+values (LOCAL_CACHE_MAX_BYTES, LOCAL_CACHE_TIMEOUT). Local entries are stored
+under the same versioned keys, and every read checks the namespace version in
+the shared cache, so no worker serves an entry another worker has invalidated.
+The worker's last seen version is only a guess at the key: a local hit costs
+one small version read, a local miss a single ``get_many`` of the version and
+the entry. Cached values are shared between requests and must be treated as
+read-only.
+
+Entries carry the time they were fetched. Resources with a stale window keep
+serving their last good copy past the TTL while a background refresh runs, so
+a rate-limited or slow Spotify degrades to "stale since ..." instead of errors.
+"""
+import logging
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone as dt_timezone
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, NamedTuple, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+from .coalesce import coalesce
+from .dispatch import Priority, priority
+
+logger = logging.getLogger(__name__)
+
+_stats_lock = threading.Lock()
+_stats: Counter = Counter()
+
+_MISSING = object()
+
+
+def cache_stats() -> Dict[str, Dict[str, int]]:
+    """Hit/miss counts per namespace since this process started.
+
+    ``local_hits`` were served by this worker's LRU, ``hits`` by the shared
+    cache; ``stale`` counts hits served past their TTL while refreshing.
+    """
+    with _stats_lock:
+        snapshot = dict(_stats)
+    stats: Dict[str, Dict[str, int]] = {}
+    for (namespace, outcome), count in sorted(snapshot.items()):
+        stats.setdefault(namespace, {'local_hits': 0, 'hits': 0, 'misses': 0, 'stale': 0})[outcome] = count
+    return stats
+
+
+def _record(namespace: str, local_hits: int = 0, hits: int = 0, misses: int = 0, stale: int = 0) -> None:
+    with _stats_lock:
+        if stale:
+            _stats[(namespace, 'stale')] += stale
+        if local_hits:
+            _stats[(namespace, 'local_hits')] += local_hits
+        if hits:
+            _stats[(namespace, 'hits')] += hits
+        if misses:
+            _stats[(namespace, 'misses')] += misses
+
+
+def _approx_size(value: Any, depth: int = 0) -> int:
+    """Rough serialized size of ``value`` in bytes, without serializing it.
+
+    Containers are sized from a few sampled elements (evenly spaced for
+    sequences, the first few otherwise) scaled up to their length, so the
+    cost stays constant however large the value is.
+    """
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value) + 3
+    if value is None or isinstance(value, (bool, int, float)):
+        return 5
+    nbytes = getattr(value, 'nbytes', None)
+    if isinstance(nbytes, int):
+        return nbytes
+    if depth >= 6:
+        return sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        sample = value[::max(1, len(value) // 4)][:4]
+    elif isinstance(value, dict):
+        sample = list(islice(value.items(), 4))
+    elif isinstance(value, (set, frozenset)):
+        sample = list(islice(value, 4))
+    elif hasattr(value, '__dict__'):
+        return _approx_size(vars(value), depth + 1)
+    else:
+        return sys.getsizeof(value)
+    if not sample:
+        return 2
+    per_item = sum(_approx_size(item, depth + 1) for item in sample) / len(sample)
+    return 2 + int(per_item * len(value))
+
+
+class LocalLRU:
+    """Bounded, thread-safe in-process LRU with per-entry expiry.
+
+    Sizes are estimated once on insert (see ``_approx_size``), so the byte
+    budget is approximate. Values estimated above a quarter of the budget are
+    not kept locally.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, int, Any]]" = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            expires_at, _, value = entry
+            if expires_at <= time.monotonic():
+                self._pop(key)
+                return _MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, timeout: float) -> None:
+        max_bytes = settings.LOCAL_CACHE_MAX_BYTES
+        size = _approx_size(value)
+        with self._lock:
+            self._pop(key)
+            if size > max_bytes // 4 or timeout <= 0:
+                return
+            self._entries[key] = (time.monotonic() + timeout, size, value)
+            self._bytes += size
+            while self._bytes > max_bytes:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def _pop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._pop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+local_tier = LocalLRU()
+
+
+class _Stamped(NamedTuple):
+    """A cached value and when it was fetched (epoch seconds)."""
+    value: Any
+    fetched_at: float
+
+
+def _retry_after(error: Exception) -> Optional[int]:
+    """Seconds Spotify asked us to wait, from a rate-limited response."""
+    response = getattr(error, 'response', None)
+    try:
+        return int(response.headers['Retry-After'])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+class ResourceCache:
+    """Cache policy for one kind of resource.
+
+    ``timeout_setting`` names the settings attribute holding the TTL in
+    seconds; it is read on every write so it can be overridden per deployment
+    or in tests. ``per_user`` resources require a ``user`` on every call.
+
+    ``stale_setting`` enables stale-while-revalidate: entries are kept that
+    many seconds past their TTL. ``get_or_set`` serves such a stale copy
+    immediately and refreshes it in the background, and plain reads can ask
+    for it explicitly (``allow_stale``) when a live fetch fails.
+    """
+
+    def __init__(self, namespace: str, timeout_setting: str, per_user: bool = False,
+                 stale_setting: Optional[str] = None):
+        self.namespace = namespace
+        self.timeout_setting = timeout_setting
+        self.per_user = per_user
+        self.stale_setting = stale_setting
+
+    @property
+    def timeout(self) -> int:
+        return getattr(settings, self.timeout_setting)
+
+    @property
+    def stale_window(self) -> int:
+        return getattr(settings, self.stale_setting) if self.stale_setting else 0
+
+    @property
+    def local_timeout(self) -> int:
+        return min(settings.LOCAL_CACHE_TIMEOUT, self.timeout)
+
+    def _owner(self, user) -> str:
+        if not self.per_user:
+            return '-'
+        if user is None:
+            raise ValueError(f"{self.namespace} cache entries are per user")
+        return str(user.pk)
+
+    def _version_key(self, owner: str) -> str:
+        return f"{self.namespace}:version:{owner}"
+
+    def _seen_version(self, version_key: str, version: int) -> int:
+        # Remembered only to guess the next key; reads still check it
+        local_tier.set(version_key, version, settings.LOCAL_CACHE_TIMEOUT)
+        return version
+
+    def version(self, user=None) -> int:
+        version_key = self._version_key(self._owner(user))
+        return self._seen_version(version_key, cache.get(version_key, 1))
+
+    def _versioned_prefix(self, version: int, owner: str) -> str:
+        return f"{self.namespace}:v{version}:{owner}"
+
+    def _prefix(self, user) -> str:
+        return self._versioned_prefix(self.version(user), self._owner(user))
+
+    def key(self, *parts, user=None) -> str:
+        return ':'.join([self._prefix(user), *map(str, parts)])
+
+    def _is_fresh(self, entry: _Stamped) -> bool:
+        return time.time() - entry.fetched_at < self.timeout
+
+    def _read_many(self, parts_list: Iterable[Sequence], user) -> Tuple[Dict[str, Tuple], Dict[str, _Stamped]]:
+        """Look up entries in both tiers under the current shared version.
+
+        Returns ({key: parts} for every requested entry, {key: entry} for the
+        ones found).
+        """
+        owner = self._owner(user)
+        version_key = self._version_key(owner)
+        parts_list = [tuple(parts) for parts in parts_list]
+        guess = local_tier.get(version_key)
+        if guess is _MISSING:
+            guess = 1
+        version = None
+        while True:
+            prefix = self._versioned_prefix(guess, owner)
+            keys = {':'.join([prefix, *map(str, parts)]): parts for parts in parts_list}
+            found = {}
+            for key in keys:
+                entry = local_tier.get(key)
+                if entry is not _MISSING:
+                    found[key] = entry
+            remote_keys = [key for key in keys if key not in found]
+            if version is None:
+                # The version rides along with the first shared read
+                remote = cache.get_many([version_key, *remote_keys])
+                version = self._seen_version(version_key, remote.pop(version_key, 1))
+            else:
+                remote = cache.get_many(remote_keys) if remote_keys else {}
+            if guess == version:
+                break
+            # Another worker invalidated since this one last looked
+            guess = version
+        remote = {key: entry for key, entry in remote.items() if isinstance(entry, _Stamped)}
+        for key, entry in remote.items():
+            local_tier.set(key, entry, self.local_timeout)
+        _record(self.namespace, local_hits=len(found), hits=len(remote),
+                misses=len(keys) - len(found) - len(remote))
+        found.update(remote)
+        return keys, found
+
+    def _read(self, parts: Sequence, user) -> Tuple[str, Any]:
+        """The key of ``parts`` and its stamped entry from either tier, or _MISSING."""
+        keys, found = self._read_many([parts], user)
+        key = next(iter(keys))
+        return key, found.get(key, _MISSING)
+
+    def _write(self, key: str, value: Any) -> None:
+        entry = _Stamped(value, time.time())
+        cache.set(key, entry, self.timeout + self.stale_window)
+        local_tier.set(key, entry, self.local_timeout)
+
+    def get(self, *parts, user=None, default=None, allow_stale: bool = False) -> Any:
+        _, entry = self._read(parts, user)
+        if entry is _MISSING or not (allow_stale or self._is_fresh(entry)):
+            return default
+        return entry.value
+
+    def set(self, *parts, value, user=None) -> None:
+        self._write(self.key(*parts, user=user), value)
+
+    def delete(self, *parts, user=None) -> None:
+        key = self.key(*parts, user=user)
+        cache.delete(key)
+        local_tier.discard(key)
+
+    def stale_since(self, *parts, user=None) -> Optional[datetime]:
+        """When the cached copy was fetched, if it is past its TTL; else None."""
+        _, entry = self._read(parts, user)
+        if entry is _MISSING or self._is_fresh(entry):
+            return None
+        return datetime.fromtimestamp(entry.fetched_at, tz=dt_timezone.utc)
+
+    def get_or_set(self, *parts, compute: Callable[[], Any], user=None) -> Any:
+        """Return the cached value, computing and storing it on a miss.
+
+        A stale copy is returned as-is while one background refresh replaces
+        it. Concurrent misses for the same entry, in this worker or others,
+        share a single ``compute()`` (see accounts.coalesce).
+        """
+        key, entry = self._read(parts, user)
+        if entry is not _MISSING:
+            if not self._is_fresh(entry):
+                _record(self.namespace, stale=1)
+                self._refresh_in_background(key, compute)
+            return entry.value
+
+        def fill():
+            # A worker that held the lock just before us may have filled it
+            entry = cache.get(key)
+            if isinstance(entry, _Stamped) and self._is_fresh(entry):
+                return entry.value
+            value = compute()
+            self._write(key, value)
+            return value
+
+        def poll():
+            entry = cache.get(key)
+            return entry.value if isinstance(entry, _Stamped) else None
+
+        return coalesce(key, fill, poll=poll)
+
+    def _refresh_in_background(self, key: str, compute: Callable[[], Any]) -> None:
+        # One refresh at a time across workers. After a failure the lock is
+        # left to expire (or held for Spotify's Retry-After), which spaces
+        # out retries while the stale copy keeps being served.
+        lock_key = f"refresh:{key}"
+        if not cache.add(lock_key, 1, settings.CACHE_REFRESH_RETRY_TIMEOUT):
+            return
+
+        def refresh():
+            try:
+                with priority(Priority.BACKGROUND):
+                    value = compute()
+            except Exception as e:
+                retry_after = _retry_after(e)
+                if retry_after:
+                    cache.set(lock_key, 1, retry_after)
+                logger.warning("Background refresh of %s failed: %s", key, e)
+                return
+            finally:
+                connections.close_all()
+            self._write(key, value)
+            cache.delete(lock_key)
+
+        threading.Thread(target=refresh, name=f"refresh {key}", daemon=True).start()
+
+    def get_many(self, parts_list: Iterable[Sequence], user=None, allow_stale: bool = False) -> Dict[Tuple, Any]:
+        """Bulk read; returns {parts tuple: value} for the entries found."""
+        keys, found = self._read_many(parts_list, user)
+        return {
+            keys[key]: entry.value for key, entry in found.items()
+            if allow_stale or self._is_fresh(entry)
+        }
+
+    def set_many(self, values: Dict[Tuple, Any], user=None) -> None:
+        prefix = self._prefix(user)
+        now = time.time()
+        entries = {
+            ':'.join([prefix, *map(str, parts)]): _Stamped(value, now)
+            for parts, value in values.items()
+        }
+        cache.set_many(entries, self.timeout + self.stale_window)
+        for key, entry in entries.items():
+            local_tier.set(key, entry, self.local_timeout)
+
+    def invalidate(self, user=None) -> None:
+        """Drop every entry of this namespace (for ``user``, if per user)."""
+        version_key = self._version_key(self._owner(user))
+        # Version keys are stored without a timeout. If the backend evicts one
+        # anyway, numbering restarts at 1 and old entries may resurface until
+        # their own TTL runs out.
+        version = 2
+        if not cache.add(version_key, version, None):
+            try:
+                version = cache.incr(version_key)
+            except ValueError:
+                cache.set(version_key, version, None)
+        self._seen_version(version_key, version)
+
+
+# Whether a user has connected Spotify at all
+SPOTIFY_CONNECTED = ResourceCache('spotify_connected', 'SPOTIFY_CONNECTED_CACHE_TIMEOUT', per_user=True)
+
+# Spotify API resources
+USER_PLAYLISTS = ResourceCache('playlists', 'SPOTIFY_PLAYLISTS_CACHE_TIMEOUT', per_user=True,
+                               stale_setting='SPOTIFY_STALE_TIMEOUT')
+USER_PROFILE = ResourceCache('profile', 'SPOTIFY_PROFILE_CACHE_TIMEOUT', per_user=True,
+                             stale_setting='SPOTIFY_STALE_TIMEOUT')
+PLAYLIST_TRACKS = ResourceCache('playlist_tracks', 'PLAYLIST_SNAPSHOT_CACHE_TIMEOUT')
+CHARTS = ResourceCache('charts', 'CHART_CACHE_TIMEOUT', stale_setting='SPOTIFY_STALE_TIMEOUT')
+
+# Results computed from them
+ANALYTICS = ResourceCache('analytics', 'ANALYTICS_CACHE_TIMEOUT', per_user=True)
+GEO = ResourceCache('geo', 'PLAYLIST_SNAPSHOT_CACHE_TIMEOUT')
+GEO_PARTIAL = ResourceCache('geo_partial', 'PLAYLIST_SNAPSHOT_CACHE_TIMEOUT')
+PLAYLIST_SETS = ResourceCache('playlist_sets', 'PLAYLIST_SNAPSHOT_CACHE_TIMEOUT')
+CHART_SIMILARITY = ResourceCache('chart_similarity', 'PLAYLIST_SNAPSHOT_CACHE_TIMEOUT')
+
+
+def invalidate_user(user) -> None:
+    """Forget everything cached for ``user`` (e.g. after (re)connecting Spotify)."""
+    for resource in (SPOTIFY_CONNECTED, USER_PLAYLISTS, USER_PROFILE, ANALYTICS):
+        resource.invalidate(user)
@@ -0,0 +1,106 @@
+"""Coalescing of identical concurrent upstream calls.
+
+Within a worker, callers asking for a key while a call for it is in flight
+wait for that call and share its result or exception. Across workers, the
+first caller takes a lock in the shared cache (``cache.add``) and the others
+poll for the result instead of calling Spotify themselves: either through a
+caller-supplied ``poll`` (e.g. reading the cache entry the leader fills) or a
+short-lived result entry the leader publishes. Waiting workers flag
+themselves, and the leader only publishes when one did, so uncontended calls
+never copy their result into the shared cache.
+
+Waiting is bounded by COALESCE_WAIT_TIMEOUT. A waiter that gives up, or sees
+the leader finish without a result, makes the call itself, so a slow or
+crashed leader can delay callers but never block them.
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+_MISSING = object()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+_inflight_lock = threading.Lock()
+_inflight: Dict[str, _Call] = {}
+
+
+def coalesce(key: str, fn: Callable[[], Any], poll: Optional[Callable[[], Any]] = None) -> Any:
+    """Return ``fn()``, sharing one call among concurrent callers of ``key``.
+
+    ``poll`` returns the leader's result once it is available elsewhere (or
+    None before that). Without it, a leader that other workers are waiting on
+    publishes its result in the shared cache for COALESCE_RESULT_TIMEOUT
+    seconds.
+    """
+    with _inflight_lock:
+        call = _inflight.get(key)
+        leader = call is None
+        if leader:
+            call = _inflight[key] = _Call()
+
+    if not leader:
+        if not call.done.wait(settings.COALESCE_WAIT_TIMEOUT):
+            return fn()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    try:
+        call.result = _across_workers(key, fn, poll)
+        return call.result
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+        call.done.set()
+
+
+def _across_workers(key: str, fn: Callable[[], Any], poll: Optional[Callable[[], Any]]) -> Any:
+    lock_key = f"inflight:{key}:lock"
+    result_key = f"inflight:{key}:result"
+    waiting_key = f"inflight:{key}:waiting"
+
+    if cache.add(lock_key, 1, settings.COALESCE_LOCK_TIMEOUT):
+        try:
+            value = fn()
+            if poll is None and cache.get(waiting_key):
+                cache.set(result_key, value, settings.COALESCE_RESULT_TIMEOUT)
+            return value
+        finally:
+            cache.delete_many([lock_key, waiting_key])
+
+    if poll is None:
+        cache.set(waiting_key, 1, settings.COALESCE_LOCK_TIMEOUT)
+
+    def result():
+        value = poll() if poll is not None else cache.get(result_key, _MISSING)
+        return _MISSING if value is None else value
+
+    # Another worker is already fetching this; wait for its result
+    deadline = time.monotonic() + settings.COALESCE_WAIT_TIMEOUT
+    delay = 0.05
+    while time.monotonic() < deadline:
+        time.sleep(delay)
+        delay = min(delay * 2, 0.5)
+        value = result()
+        if value is not _MISSING:
+            return value
+        if cache.get(lock_key) is None:
+            # The leader is done; it may have published just before releasing
+            value = result()
+            if value is not _MISSING:
+                return value
+            break
+    return fn()
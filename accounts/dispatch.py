@@ -0,0 +1,172 @@
+"""Priority-aware dispatch of outbound Spotify API calls.
+
+Every call is tagged with the priority class of the work it serves, taken from
+a context variable: INTERACTIVE (the default; a user is waiting on it),
+BACKGROUND (cache refreshes, chart prewarm) or BULK (library scans, exports,
+management commands). Work sets its class with ``priority(...)``, as a context
+manager or decorator, or ``prioritized(...)`` for streamed response bodies.
+
+Calls draw from a per-worker token bucket refilled at SPOTIFY_RATE_LIMIT per
+second. Interactive calls only wait for a token. Lower classes also wait while
+a higher class is queued, or while taking a token would dip into the share
+of the bucket kept for the classes above them (SPOTIFY_INTERACTIVE_RESERVE per
+class). A 429 empties the bucket and holds lower classes back until Spotify's
+Retry-After has passed, so a heavy export never makes swiping laggy.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from enum import IntEnum
+from typing import Iterable, Iterator, TypeVar
+
+import requests  # type: ignore
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+T = TypeVar('T')
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BACKGROUND = 1
+    BULK = 2
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar('spotify_priority', default=Priority.INTERACTIVE)
+
+
+def current_priority() -> Priority:
+    return _current.get()
+
+
+@contextmanager
+def priority(cls: Priority):
+    """Run the enclosed Spotify calls in priority class ``cls``."""
+    token = _current.set(cls)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def prioritized(items: Iterable[T], cls: Priority) -> Iterator[T]:
+    """Iterate ``items`` with every step run in priority class ``cls``.
+
+    Streamed response bodies are consumed after the view has returned, outside
+    any ``with priority(...)`` block in it, so they are tagged step by step.
+    """
+    iterator = iter(items)
+    while True:
+        with priority(cls):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def check_settings() -> None:
+    """Reject rate-limit settings the dispatcher can't schedule with."""
+    if settings.SPOTIFY_RATE_LIMIT <= 0:
+        raise ImproperlyConfigured("SPOTIFY_RATE_LIMIT must be a positive number of calls per second")
+    if settings.SPOTIFY_INTERACTIVE_RESERVE < 0:
+        raise ImproperlyConfigured("SPOTIFY_INTERACTIVE_RESERVE must not be negative")
+    # The lowest class needs one token on top of every reserve above it
+    if settings.SPOTIFY_RATE_BURST <= settings.SPOTIFY_INTERACTIVE_RESERVE * max(Priority):
+        raise ImproperlyConfigured(
+            "SPOTIFY_RATE_BURST must exceed SPOTIFY_INTERACTIVE_RESERVE * "
+            f"{int(max(Priority))}, or {max(Priority).name} calls can never run"
+        )
+
+
+class Dispatcher:
+    """Token bucket that hands out call slots by priority class."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._tokens = None
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiting = [0] * len(Priority)
+
+    def _refill(self, now: float) -> None:
+        burst = settings.SPOTIFY_RATE_BURST
+        if self._tokens is None:
+            self._tokens = float(burst)
+        self._tokens = min(burst, self._tokens + (now - self._updated) * settings.SPOTIFY_RATE_LIMIT)
+        self._updated = now
+
+    def _delay(self, cls: Priority, now: float) -> float:
+        """Seconds until ``cls`` may go, 0 when it can take a token now."""
+        if cls > Priority.INTERACTIVE and now < self._paused_until:
+            return self._paused_until - now
+        if any(self._waiting[higher] for higher in range(cls)):
+            # Woken when the higher class leaves the queue
+            return 1.0
+        needed = 1 + settings.SPOTIFY_INTERACTIVE_RESERVE * cls - self._tokens
+        return max(needed, 0) / settings.SPOTIFY_RATE_LIMIT
+
+    def acquire(self, cls: Priority) -> None:
+        """Block until a call of class ``cls`` may be made, then take its token."""
+        with self._cond:
+            self._waiting[cls] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    delay = self._delay(cls, now)
+                    if delay <= 0:
+                        self._tokens -= 1
+                        return
+                    self._cond.wait(delay)
+            finally:
+                self._waiting[cls] -= 1
+                self._cond.notify_all()
+
+    def paused_for(self) -> float:
+        """Seconds left before lower classes may call Spotify again after a 429."""
+        return max(0.0, self._paused_until - time.monotonic())
+
+    def pause(self, seconds: float) -> None:
+        """Spotify rate-limited us: drain the bucket and hold back lower classes."""
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens = 0.0
+            self._paused_until = max(self._paused_until, now + seconds)
+
+
+dispatcher = Dispatcher()
+
+
+def _retry_after_seconds(response) -> float:
+    try:
+        return float(response.headers.get('Retry-After', 1))
+    except (TypeError, ValueError):
+        return 1.0
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    """``requests.request`` scheduled at the caller's priority class."""
+    dispatcher.acquire(current_priority())
+    response = requests.request(method, url, **kwargs)
+    if response.status_code == 429:
+        dispatcher.pause(_retry_after_seconds(response))
+    return response
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request('GET', url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request('POST', url, **kwargs)
+
+
+def put(url: str, **kwargs) -> requests.Response:
+    return request('PUT', url, **kwargs)
+
+
+def delete(url: str, **kwargs) -> requests.Response:
+    return request('DELETE', url, **kwargs)
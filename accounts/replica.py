@@ -0,0 +1,118 @@
+"""Routing of reporting reads to a read replica.
+
+When a ``replica`` database is configured (DATABASE_REPLICA_NAME), views
+marked ``@reporting`` (analytics, exports, the decision admin listing) read
+from it, so their heavy queries stay off the connection that serves
+save_decision. Writes always go to the primary. Outside a reporting view,
+or with no replica configured, everything uses the primary as before.
+
+A user who has just changed their decisions reads from the primary for
+REPLICA_STICKY_SECONDS (see ``stick_to_primary``), so the analytics they
+open next include that write even if the replica lags behind.
+"""
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+REPLICA_ALIAS = 'replica'
+
+_use_replica: contextvars.ContextVar = contextvars.ContextVar('use_replica', default=False)
+
+
+def replica_configured() -> bool:
+    return REPLICA_ALIAS in settings.DATABASES
+
+
+@contextmanager
+def use_replica():
+    """Send reads in the enclosed block to the replica."""
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def _sticky_key(user) -> str:
+    return f"replica:sticky:{user.pk}"
+
+
+def stick_to_primary(user) -> None:
+    """Pin ``user``'s reporting reads to the primary after they wrote."""
+    if replica_configured():
+        cache.set(_sticky_key(user), 1, settings.REPLICA_STICKY_SECONDS)
+
+
+def on_replica(content):
+    """Iterate ``content`` with every step reading from the replica (streamed bodies)."""
+    iterator = iter(content)
+    while True:
+        with use_replica():
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+        yield chunk
+
+
+async def _on_replica_async(content):
+    iterator = content.__aiter__()
+    while True:
+        with use_replica():
+            try:
+                chunk = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+        yield chunk
+
+
+def reporting(view_func):
+    """Serve a read-only view from the replica, including its streamed body.
+
+    Only GET/HEAD requests are routed; users pinned by ``stick_to_primary``
+    and setups without a replica read from the primary.
+    """
+    @wraps(view_func)
+    def wrapped(request, *args, **kwargs):
+        user = getattr(request, 'user', None)
+        if (request.method not in ('GET', 'HEAD') or not replica_configured()
+                or (user is not None and user.is_authenticated and cache.get(_sticky_key(user)))):
+            return view_func(request, *args, **kwargs)
+
+        with use_replica():
+            response = view_func(request, *args, **kwargs)
+            # Template responses evaluate their querysets while rendering
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+        if getattr(response, 'streaming', False):
+            wrap = _on_replica_async if response.is_async else on_replica
+            response.streaming_content = wrap(response.streaming_content)
+        return response
+    return wrapped
+
+
+class ReplicaRouter:
+    """Reads inside ``use_replica`` go to the replica; all writes to the primary."""
+
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and replica_configured():
+            return REPLICA_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Explicit, so rows read from the replica are still saved to the primary
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, REPLICA_ALIAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica is a copy of the primary's schema and data
+        return db != REPLICA_ALIAS
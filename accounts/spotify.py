@@ -1,7 +1,12 @@
 from django.conf import settings
 from datetime import timedelta
 from django.utils import timezone
+import contextvars
+import threading
 import requests #type: ignore
+from .cache import SPOTIFY_CONNECTED, USER_PLAYLISTS, USER_PROFILE
+from . import dispatch
+from .coalesce import coalesce
 from .models import SpotifyToken
 
 TOKEN_URL = "https://accounts.spotify.com/api/token"
@@ -82,9 +87,7 @@ def get_top_charts_for_country(user, country_code: str):
     """
     country_code = country_code.upper()
     
-    st = SpotifyToken.objects.get(user=user)
-    if st.is_expired():
-        st = refresh_spotify_token_for_user(user)
+    st = spotify_context(user).token()
     
     headers = {"Authorization": f"Bearer {st.access_token}"}
     
@@ -113,7 +116,7 @@ def get_top_charts_for_country(user, country_code: str):
     # If we have a known playlist ID, try it first
     if playlist_id:
         url = f"{API_BASE}/playlists/{playlist_id}/tracks?limit=50"
-        r = requests.get(url, headers=headers)
+        r = dispatch.get(url, headers=headers, timeout=settings.SPOTIFY_REQUEST_TIMEOUT)
         print(f"[Charts] Hardcoded playlist {playlist_id}: status {r.status_code}")
         if r.status_code == 200:
             data = r.json()
@@ -126,7 +129,7 @@ def get_top_charts_for_country(user, country_code: str):
     if country_name:
         search_query = f"Top 50 {country_name}"
         search_url = f"{API_BASE}/search?q={requests.utils.quote(search_query)}&type=playlist&limit=10"
-        r = requests.get(search_url, headers=headers)
+        r = dispatch.get(search_url, headers=headers, timeout=settings.SPOTIFY_REQUEST_TIMEOUT)
         print(f"[Charts] Search for '{search_query}': status {r.status_code}")
         
         if r.status_code == 200:
@@ -152,7 +155,7 @@ def get_top_charts_for_country(user, country_code: str):
             
             if found_playlist_id:
                 url = f"{API_BASE}/playlists/{found_playlist_id}/tracks?limit=50"
-                r = requests.get(url, headers=headers)
+                r = dispatch.get(url, headers=headers, timeout=settings.SPOTIFY_REQUEST_TIMEOUT)
                 print(f"[Charts] Fetching playlist tracks: status {r.status_code}")
                 if r.status_code == 200:
                     data = r.json()
@@ -162,7 +165,7 @@ def get_top_charts_for_country(user, country_code: str):
     if country_name:
         for search_term in [f"{country_name} top hits", f"{country_name} charts 2024", f"top songs {country_name}"]:
             search_url = f"{API_BASE}/search?q={requests.utils.quote(search_term)}&type=playlist&limit=5"
-            r = requests.get(search_url, headers=headers)
+            r = dispatch.get(search_url, headers=headers, timeout=settings.SPOTIFY_REQUEST_TIMEOUT)
             print(f"[Charts] Search for '{search_term}': status {r.status_code}")
             
             if r.status_code == 200:
@@ -180,7 +183,7 @@ def get_top_charts_for_country(user, country_code: str):
                 
                 if found_playlist_id:
                     url = f"{API_BASE}/playlists/{found_playlist_id}/tracks?limit=50"
-                    r = requests.get(url, headers=headers)
+                    r = dispatch.get(url, headers=headers, timeout=settings.SPOTIFY_REQUEST_TIMEOUT)
                     if r.status_code == 200:
                         data = r.json()
                         return _parse_playlist_artists(data, country_code, True)
@@ -190,7 +193,7 @@ def get_top_charts_for_country(user, country_code: str):
     print(f"[Charts] Trying Global Top 50 fallback")
     global_id = SPOTIFY_TOP50_PLAYLISTS.get('GLOBAL', '37i9dQZEVXbMDoHDwVN2tF')
     url = f"{API_BASE}/playlists/{global_id}/tracks?limit=50"
-    r = requests.get(url, headers=headers)
+    r = dispatch.get(url, headers=headers, timeout=settings.SPOTIFY_REQUEST_TIMEOUT)
     print(f"[Charts] Global playlist: status {r.status_code}")
     
     if r.status_code == 200:
@@ -204,7 +207,7 @@ def get_top_charts_for_country(user, country_code: str):
     print(f"[Charts] Trying Today's Top Hits fallback")
     todays_top_hits = '37i9dQZF1DXcBWIGoYBM5M'
     url = f"{API_BASE}/playlists/{todays_top_hits}/tracks?limit=50"
-    r = requests.get(url, headers=headers)
+    r = dispatch.get(url, headers=headers, timeout=settings.SPOTIFY_REQUEST_TIMEOUT)
     print(f"[Charts] Today's Top Hits: status {r.status_code}")
     
     if r.status_code == 200:
@@ -266,7 +269,7 @@ def refresh_spotify_token_for_user(user):
         "client_id": settings.SPOTIFY_CLIENT_ID,
         "client_secret": settings.SPOTIFY_CLIENT_SECRET,
     }
-    r = requests.post(TOKEN_URL, data=data)
+    r = requests.post(TOKEN_URL, data=data, timeout=settings.SPOTIFY_REQUEST_TIMEOUT)
     r.raise_for_status()
     token_data = r.json()
     st.access_token = token_data.get("access_token")
@@ -281,6 +284,105 @@ def refresh_spotify_token_for_user(user):
     return st
 
 
+class SpotifyContext:
+    """A user's Spotify credentials, loaded once and shared by every call.
+
+    SpotifyContextMiddleware attaches one to each request as
+    ``request.spotify`` and makes it current, so all client calls made for
+    that user during the request (pool workers included) share one token
+    lookup and at most one refresh.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._token = _UNLOADED
+        self._lock = threading.Lock()
+
+    @property
+    def connected(self) -> bool:
+        """Whether the user has connected Spotify (cached across requests)."""
+        if self._token is not _UNLOADED:
+            return self._token is not None
+        if not self.user.is_authenticated:
+            return False
+        return SPOTIFY_CONNECTED.get_or_set(
+            user=self.user,
+            compute=lambda: SpotifyToken.objects.filter(user=self.user).exists(),
+        )
+
+    def token(self) -> SpotifyToken:
+        """The user's token, refreshed first if it has expired.
+
+        Raises SpotifyToken.DoesNotExist when Spotify isn't connected.
+        """
+        with self._lock:
+            if self._token is _UNLOADED:
+                self._token = SpotifyToken.objects.filter(user=self.user).first()
+            if self._token is None:
+                raise SpotifyToken.DoesNotExist("No Spotify token for user")
+            if self._token.is_expired():
+                self._token = refresh_spotify_token_for_user(self.user)
+            return self._token
+
+
+_UNLOADED = object()
+_current_context: contextvars.ContextVar = contextvars.ContextVar('spotify_context', default=None)
+
+
+def spotify_context(user) -> SpotifyContext:
+    """The current request's context for ``user``, or a one-off context."""
+    ctx = _current_context.get()
+    if ctx is not None and ctx.user.pk == user.pk:
+        return ctx
+    return SpotifyContext(user)
+
+
+def _in_context(content, ctx):
+    iterator = iter(content)
+    while True:
+        token = _current_context.set(ctx)
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _current_context.reset(token)
+        yield chunk
+
+
+async def _in_context_async(content, ctx):
+    iterator = content.__aiter__()
+    while True:
+        token = _current_context.set(ctx)
+        try:
+            chunk = await iterator.__anext__()
+        except StopAsyncIteration:
+            return
+        finally:
+            _current_context.reset(token)
+        yield chunk
+
+
+class SpotifyContextMiddleware:
+    """Attach a lazily loaded SpotifyContext to each request as ``request.spotify``."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        ctx = request.spotify = SpotifyContext(request.user)
+        token = _current_context.set(ctx)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_context.reset(token)
+        # Streamed bodies call Spotify after the view has returned
+        if getattr(response, 'streaming', False):
+            wrap = _in_context_async if response.is_async else _in_context
+            response.streaming_content = wrap(response.streaming_content, ctx)
+        return response
+
+
 def _format_retry_after(seconds):
     """Format retry_after seconds into a human-readable string."""
     try:
@@ -302,12 +404,31 @@ def _format_retry_after(seconds):
 
 
 def get_user_playlists(user):
-    st = SpotifyToken.objects.get(user=user)
-    if st.is_expired():
-        st = refresh_spotify_token_for_user(user)
+    """The user's playlists, cached per user for SPOTIFY_PLAYLISTS_CACHE_TIMEOUT."""
+    return USER_PLAYLISTS.get_or_set(user=user, compute=lambda: _fetch_user_playlists(user))
+
+
+def listed_snapshot(user, playlist_id):
+    """The snapshot_id of ``playlist_id`` in the user's own playlist list, or None.
+
+    Caches shared across users key playlist data by (playlist id, snapshot id);
+    only a snapshot the user's list vouches for may be used to read or fill them.
+    """
+    try:
+        playlists = get_user_playlists(user).get('items', [])
+    except Exception:
+        return None
+    for playlist in playlists:
+        if playlist and playlist.get('id') == playlist_id:
+            return playlist.get('snapshot_id') or None
+    return None
+
+
+def _fetch_user_playlists(user):
+    st = spotify_context(user).token()
     headers = {"Authorization": f"Bearer {st.access_token}"}
     url = f"{API_BASE}/me/playlists"
-    r = requests.get(url, headers=headers)
+    r = dispatch.get(url, headers=headers, timeout=settings.SPOTIFY_REQUEST_TIMEOUT)
     
     if r.status_code == 429:
         retry_after = r.headers.get('Retry-After', 'unknown')
@@ -322,28 +443,32 @@ def get_user_playlists(user):
 
 
 def get_spotify_user_profile(user):
-    """Get the current user's Spotify profile information."""
-    st = SpotifyToken.objects.get(user=user)
-    if st.is_expired():
-        st = refresh_spotify_token_for_user(user)
+    """Get the current user's Spotify profile information (cached per user)."""
+    return USER_PROFILE.get_or_set(user=user, compute=lambda: _fetch_spotify_user_profile(user))
+
+
+def _fetch_spotify_user_profile(user):
+    st = spotify_context(user).token()
     headers = {"Authorization": f"Bearer {st.access_token}"}
     url = f"{API_BASE}/me"
-    r = requests.get(url, headers=headers)
+    r = dispatch.get(url, headers=headers, timeout=settings.SPOTIFY_REQUEST_TIMEOUT)
     r.raise_for_status()
     return r.json()
 
 
-def get_playlist_tracks(user, playlist_id):
-    st = SpotifyToken.objects.get(user=user)
-    if st.is_expired():
-        st = refresh_spotify_token_for_user(user)
+def iter_playlist_track_pages(user, playlist_id):
+    """Yield a playlist's track pages one at a time, as Spotify returns them.
+
+    Each page is the raw paging object (``items``, ``total``, ``next``...), so
+    callers can report progress or fold items in before the last page arrives.
+    """
+    st = spotify_context(user).token()
     headers = {"Authorization": f"Bearer {st.access_token}"}
 
-    tracks = []
     url = f"{API_BASE}/playlists/{playlist_id}/tracks"
 
     while url:
-        r = requests.get(url, headers=headers)
+        r = dispatch.get(url, headers=headers, timeout=settings.SPOTIFY_REQUEST_TIMEOUT)
         
         if r.status_code == 429:
             retry_after = r.headers.get('Retry-After', 'unknown')
@@ -355,19 +480,32 @@ def get_playlist_tracks(user, playlist_id):
         
         r.raise_for_status()
         data = r.json()
-        tracks.extend(data["items"])  # each item contains a track
+        yield data
         url = data["next"]  # Spotify paginates, so 'next' gives next page or None
 
+
+def get_playlist_tracks(user, playlist_id):
+    """All track items of a playlist.
+
+    Concurrent identical calls (double clicks, the map and the dashboard
+    loading together) share a single download; treat the result as read-only.
+    """
+    return coalesce(f"playlist_tracks:{user.pk}:{playlist_id}",
+                    lambda: _fetch_playlist_tracks(user, playlist_id))
+
+
+def _fetch_playlist_tracks(user, playlist_id):
+    tracks = []
+    for page in iter_playlist_track_pages(user, playlist_id):
+        tracks.extend(page["items"])  # each item contains a track
     return tracks
 
 
 def get_track_info(user, track_id):
-    st = SpotifyToken.objects.get(user=user)
-    if st.is_expired():
-        st = refresh_spotify_token_for_user(user)
+    st = spotify_context(user).token()
     headers = {"Authorization": f"Bearer {st.access_token}"}
     url = f"{API_BASE}/tracks/{track_id}"
-    r = requests.get(url, headers=headers)
+    r = dispatch.get(url, headers=headers, timeout=settings.SPOTIFY_REQUEST_TIMEOUT)
     r.raise_for_status()
     return r.json()
 
@@ -378,12 +516,10 @@ def get_playlist(user, playlist_id):
     Useful when we already know the id and don't want to rely on the first-page
     results of /me/playlists.
     """
-    st = SpotifyToken.objects.get(user=user)
-    if st.is_expired():
-        st = refresh_spotify_token_for_user(user)
+    st = spotify_context(user).token()
     headers = {"Authorization": f"Bearer {st.access_token}"}
     url = f"{API_BASE}/playlists/{playlist_id}"
-    r = requests.get(url, headers=headers)
+    r = dispatch.get(url, headers=headers, timeout=settings.SPOTIFY_REQUEST_TIMEOUT)
     
     if r.status_code == 429:
         retry_after = r.headers.get('Retry-After', 'unknown')
@@ -422,9 +558,7 @@ def get_top_charts_for_country(user, country_code: str):
     """
     country_code = country_code.upper()
     
-    st = SpotifyToken.objects.get(user=user)
-    if st.is_expired():
-        st = refresh_spotify_token_for_user(user)
+    st = spotify_context(user).token()
     
     headers = {"Authorization": f"Bearer {st.access_token}"}
     
@@ -449,7 +583,7 @@ def get_top_charts_for_country(user, country_code: str):
     # If we have a known playlist ID, try it first
     if playlist_id:
         url = f"{API_BASE}/playlists/{playlist_id}/tracks?limit=50"
-        r = requests.get(url, headers=headers)
+        r = dispatch.get(url, headers=headers, timeout=settings.SPOTIFY_REQUEST_TIMEOUT)
         if r.status_code == 200:
             data = r.json()
             items = data.get('items', [])
@@ -460,7 +594,7 @@ def get_top_charts_for_country(user, country_code: str):
     if country_name:
         search_query = f"Top 50 {country_name}"
         search_url = f"{API_BASE}/search?q={requests.utils.quote(search_query)}&type=playlist&limit=10"
-        r = requests.get(search_url, headers=headers)
+        r = dispatch.get(search_url, headers=headers, timeout=settings.SPOTIFY_REQUEST_TIMEOUT)
         
         if r.status_code == 200:
             search_data = r.json()
@@ -478,7 +612,7 @@ def get_top_charts_for_country(user, country_code: str):
             
             if found_playlist_id:
                 url = f"{API_BASE}/playlists/{found_playlist_id}/tracks?limit=50"
-                r = requests.get(url, headers=headers)
+                r = dispatch.get(url, headers=headers, timeout=settings.SPOTIFY_REQUEST_TIMEOUT)
                 if r.status_code == 200:
                     data = r.json()
                     return _parse_playlist_artists(data, country_code, True)
@@ -487,7 +621,7 @@ def get_top_charts_for_country(user, country_code: str):
     if country_name:
         for search_term in [f"{country_name} top hits", f"{country_name} charts 2024", f"top songs {country_name}"]:
             search_url = f"{API_BASE}/search?q={requests.utils.quote(search_term)}&type=playlist&limit=5"
-            r = requests.get(search_url, headers=headers)
+            r = dispatch.get(search_url, headers=headers, timeout=settings.SPOTIFY_REQUEST_TIMEOUT)
             
             if r.status_code == 200:
                 search_data = r.json()
@@ -503,7 +637,7 @@ def get_top_charts_for_country(user, country_code: str):
                 
                 if found_playlist_id:
                     url = f"{API_BASE}/playlists/{found_playlist_id}/tracks?limit=50"
-                    r = requests.get(url, headers=headers)
+                    r = dispatch.get(url, headers=headers, timeout=settings.SPOTIFY_REQUEST_TIMEOUT)
                     if r.status_code == 200:
                         data = r.json()
                         return _parse_playlist_artists(data, country_code, True)
@@ -512,7 +646,7 @@ def get_top_charts_for_country(user, country_code: str):
     # Final fallback: Global Top 50
     global_id = SPOTIFY_TOP50_PLAYLISTS.get('GLOBAL', '37i9dQZEVXbMDoHDwVN2tF')
     url = f"{API_BASE}/playlists/{global_id}/tracks?limit=50"
-    r = requests.get(url, headers=headers)
+    r = dispatch.get(url, headers=headers, timeout=settings.SPOTIFY_REQUEST_TIMEOUT)
     
     if r.status_code == 200:
         data = r.json()
@@ -529,25 +663,34 @@ def get_top_charts_for_country(user, country_code: str):
 
 
 def _parse_playlist_artists(data, country_code, has_chart):
-    """Parse playlist tracks and count artist appearances."""
+    """Parse playlist tracks and count artist appearances.
+
+    The chart's tracks are kept in rank order (id, name and artist names) so
+    callers can compare them against a user's own tracks.
+    """
     artist_counts = {}
+    tracks = []
     
     for item in data.get('items', []):
         track = item.get('track')
         if not track:
             continue
         
+        names = []
         for artist in track.get('artists', []):
             name = artist.get('name')
             if name:
                 artist_counts[name] = artist_counts.get(name, 0) + 1
+                names.append(name)
+        tracks.append({'id': track.get('id'), 'name': track.get('name'), 'artists': names})
     
     top_artists = sorted(artist_counts.items(), key=lambda x: x[1], reverse=True)[:10]
     
     return {
         'country_code': country_code,
         'has_chart': has_chart,
-        'artists': [{'name': name, 'count': count} for name, count in top_artists]
+        'artists': [{'name': name, 'count': count} for name, count in top_artists],
+        'tracks': tracks,
     }
 
 
@@ -567,9 +710,7 @@ def remove_tracks_from_playlist(user, playlist_id, track_uris):
     Returns:
         Response from Spotify API
     """
-    st = SpotifyToken.objects.get(user=user)
-    if st.is_expired():
-        st = refresh_spotify_token_for_user(user)
+    st = spotify_context(user).token()
     
     headers = {
         "Authorization": f"Bearer {st.access_token}",
@@ -582,8 +723,10 @@ def remove_tracks_from_playlist(user, playlist_id, track_uris):
     tracks_payload = [{"uri": uri} for uri in track_uris]
     payload = {"tracks": tracks_payload}
     
-    r = requests.delete(url, headers=headers, json=payload)
+    r = dispatch.delete(url, headers=headers, json=payload, timeout=settings.SPOTIFY_REQUEST_TIMEOUT)
     r.raise_for_status()
+    # Track counts and snapshot ids in the cached playlist list are now stale
+    USER_PLAYLISTS.invalidate(user)
     return r.json()
 
 
@@ -606,16 +749,12 @@ def play_track(request):
     track_uri = data.get("uri")
 
     try:
-        st = SpotifyToken.objects.get(user=request.user)
+        st = request.spotify.token()
     except SpotifyToken.DoesNotExist:
         return JsonResponse(
             {"status": "error", "message": "No Spotify token for user"}, status=400
         )
 
-    # Refresh token if expired
-    if st.is_expired():
-        st = refresh_spotify_token_for_user(request.user)
-
     access_token = st.access_token
 
     # Play the track
@@ -626,7 +765,7 @@ def play_track(request):
     }
     payload = {"uris": [track_uri]}
 
-    r = requests.put(url, headers=headers, json=payload)
+    r = dispatch.put(url, headers=headers, json=payload, timeout=settings.SPOTIFY_REQUEST_TIMEOUT)
 
     if r.status_code in [204, 202]:
         return JsonResponse({"status": "success"})
@@ -0,0 +1,51 @@
+"""SQLite backend for the production profile (ENGINE 'accounts.sqlite').
+
+Stock django.db.backends.sqlite3 plus the two OPTIONS Django 5.1 adds, which
+the 5.0 we run lacks:
+
+- ``init_command``: SQL run on every new connection; settings use it for
+  ``PRAGMA journal_mode=WAL`` (readers no longer block the writer or each
+  other) and ``PRAGMA synchronous=NORMAL`` (safe under WAL, no fsync per
+  commit).
+- ``transaction_mode``: how transactions begin. Settings use IMMEDIATE: a
+  deferred transaction that reads before it writes (as update_or_create
+  does) can't wait for the write lock and fails with "database is locked"
+  straight away, whatever the busy timeout is.
+
+The options behave as they do in 5.1, so after upgrading the ENGINE can go
+back to django.db.backends.sqlite3 with the same OPTIONS.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+
+TRANSACTION_MODES = ('DEFERRED', 'EXCLUSIVE', 'IMMEDIATE')
+
+
+class DatabaseWrapper(SQLiteDatabaseWrapper):
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        # Not sqlite3.connect() arguments; kept for the connection itself
+        self.init_command = kwargs.pop('init_command', None)
+        transaction_mode = kwargs.pop('transaction_mode', None)
+        if transaction_mode is not None and transaction_mode.upper() not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                f"settings.DATABASES['{self.alias}']['OPTIONS']['transaction_mode'] must be "
+                f"one of {', '.join(TRANSACTION_MODES)}, not {transaction_mode!r}"
+            )
+        self.transaction_mode = transaction_mode.upper() if transaction_mode else None
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        if self.init_command:
+            for statement in self.init_command.split(';'):
+                if statement.strip():
+                    conn.execute(statement)
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if self.transaction_mode is None:
+            super()._start_transaction_under_autocommit()
+        else:
+            self.cursor().execute(f'BEGIN {self.transaction_mode}')
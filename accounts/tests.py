@@ -1,3 +1,294 @@
-from django.test import TestCase
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from . import dispatch
+from .cache import CHARTS, USER_PLAYLISTS, local_tier
+from .dispatch import Dispatcher, Priority, priority
+from .replica import REPLICA_ALIAS, ReplicaRouter, reporting, stick_to_primary
+
+
+class _InlineThread:
+    """Stand-in for threading.Thread that runs the target on start()."""
+
+    def __init__(self, target, **kwargs):
+        self._target = target
+
+    def start(self):
+        self._target()
+
+
+class ResourceCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        local_tier.clear()
+        self.user = SimpleNamespace(pk=1)
+        self.other = SimpleNamespace(pk=2)
+
+    def test_invalidate_hides_the_users_entries(self):
+        USER_PLAYLISTS.set(user=self.user, value={'items': ['a']})
+        USER_PLAYLISTS.set(user=self.other, value={'items': ['b']})
+
+        USER_PLAYLISTS.invalidate(self.user)
+
+        self.assertIsNone(USER_PLAYLISTS.get(user=self.user))
+        self.assertEqual(USER_PLAYLISTS.get(user=self.other), {'items': ['b']})
+        self.assertEqual(USER_PLAYLISTS.version(self.user), 2)
+
+    def test_invalidate_reaches_other_workers(self):
+        USER_PLAYLISTS.set(user=self.user, value={'items': ['a']})
+        self.assertEqual(USER_PLAYLISTS.get(user=self.user), {'items': ['a']})
+
+        # Another worker invalidates: the local copy is never served again
+        cache.set(USER_PLAYLISTS._version_key('1'), 5, None)
+
+        self.assertIsNone(USER_PLAYLISTS.get(user=self.user))
+        self.assertEqual(USER_PLAYLISTS.get_many([()], user=self.user), {})
+
+        USER_PLAYLISTS.set(user=self.user, value={'items': ['b']})
+        self.assertEqual(USER_PLAYLISTS.get(user=self.user), {'items': ['b']})
+
+    def test_reads_take_one_shared_round_trip(self):
+        USER_PLAYLISTS.set(user=self.user, value={'items': ['a']})
+        USER_PLAYLISTS.set(user=self.other, value={'items': ['b']})
+        local_tier.discard(USER_PLAYLISTS.key(user=self.other))
+
+        with mock.patch.object(cache, 'get_many', wraps=cache.get_many) as get_many:
+            # Local hit: only the version is read
+            self.assertEqual(USER_PLAYLISTS.get(user=self.user), {'items': ['a']})
+            self.assertEqual(get_many.call_args.args[0], [USER_PLAYLISTS._version_key('1')])
+            # Local miss: version and entry together
+            self.assertEqual(USER_PLAYLISTS.get(user=self.other), {'items': ['b']})
+            self.assertEqual(len(get_many.call_args.args[0]), 2)
+        self.assertEqual(get_many.call_count, 2)
+
+    def test_per_user_resources_require_a_user(self):
+        with self.assertRaises(ValueError):
+            USER_PLAYLISTS.get()
+
+    @override_settings(CHART_CACHE_TIMEOUT=60, SPOTIFY_STALE_TIMEOUT=3600)
+    def test_stale_entry_is_served_then_refreshed(self):
+        CHARTS.set('US', value={'tracks': ['old']})
+        compute = mock.Mock(return_value={'tracks': ['new']})
+        later = time.time() + 120
+
+        with mock.patch('accounts.cache.time.time', return_value=later), \
+                mock.patch('accounts.cache.threading.Thread', _InlineThread):
+            # Past its TTL: the old copy comes back at once, the refresh replaces it
+            self.assertEqual(CHARTS.get_or_set('US', compute=compute), {'tracks': ['old']})
+            compute.assert_called_once_with()
+            self.assertEqual(CHARTS.get_or_set('US', compute=compute), {'tracks': ['new']})
+            self.assertIsNone(CHARTS.stale_since('US'))
+
+    @override_settings(CHART_CACHE_TIMEOUT=60, SPOTIFY_STALE_TIMEOUT=3600)
+    def test_failed_refresh_keeps_serving_the_stale_copy(self):
+        CHARTS.set('US', value={'tracks': ['old']})
+        later = time.time() + 120
+
+        with mock.patch('accounts.cache.time.time', return_value=later), \
+                mock.patch('accounts.cache.threading.Thread', _InlineThread), \
+                self.assertLogs('accounts.cache', 'WARNING'):
+            value = CHARTS.get_or_set('US', compute=mock.Mock(side_effect=RuntimeError('rate limited')))
+            self.assertEqual(value, {'tracks': ['old']})
+            self.assertIsNotNone(CHARTS.stale_since('US'))
+
+
+@override_settings(SPOTIFY_RATE_LIMIT=10, SPOTIFY_RATE_BURST=10, SPOTIFY_INTERACTIVE_RESERVE=3)
+class DispatcherTests(SimpleTestCase):
+
+    def setUp(self):
+        self.dispatcher = Dispatcher()
+
+    def _acquire_in_thread(self, cls):
+        thread = threading.Thread(target=self.dispatcher.acquire, args=(cls,), daemon=True)
+        thread.start()
+        return thread
+
+    def test_lower_classes_leave_the_reserve_to_higher_ones(self):
+        # Bulk keeps 2 x 3 tokens back: 4 of the 10 go at once, the 5th waits
+        for _ in range(4):
+            self.dispatcher.acquire(Priority.BULK)
+        waiting = self._acquire_in_thread(Priority.BULK)
+        waiting.join(0.05)
+        self.assertTrue(waiting.is_alive())
+
+        # Background only keeps 3 back, interactive nothing
+        started = time.monotonic()
+        self.dispatcher.acquire(Priority.BACKGROUND)
+        self.dispatcher.acquire(Priority.INTERACTIVE)
+        self.assertLess(time.monotonic() - started, 0.05)
+
+        waiting.join(5)
+        self.assertFalse(waiting.is_alive())
+
+    def test_rate_limited_response_pauses_lower_classes(self):
+        response = mock.Mock(status_code=429, headers={'Retry-After': '1'})
+        with mock.patch.object(dispatch, 'dispatcher', self.dispatcher), \
+                mock.patch.object(dispatch.requests, 'request', return_value=response):
+            dispatch.get('https://api.spotify.com/v1/me')
+        self.assertGreater(self.dispatcher.paused_for(), 0.5)
+
+        started = time.monotonic()
+        self.dispatcher.acquire(Priority.BACKGROUND)
+        self.assertGreaterEqual(time.monotonic() - started, 0.5)
+        self.assertEqual(self.dispatcher.paused_for(), 0)
+
+    def test_calls_take_the_priority_of_their_context(self):
+        response = mock.Mock(status_code=200, headers={})
+        with mock.patch.object(dispatch, 'dispatcher', self.dispatcher), \
+                mock.patch.object(self.dispatcher, 'acquire') as acquire, \
+                mock.patch.object(dispatch.requests, 'request', return_value=response):
+            dispatch.get('https://api.spotify.com/v1/me')
+            with priority(Priority.BULK):
+                dispatch.get('https://api.spotify.com/v1/me')
+        self.assertEqual([c.args for c in acquire.call_args_list], [(Priority.INTERACTIVE,), (Priority.BULK,)])
+
+    def test_settings_are_validated(self):
+        dispatch.check_settings()
+        for bad in ({'SPOTIFY_RATE_LIMIT': 0}, {'SPOTIFY_RATE_LIMIT': -1},
+                    {'SPOTIFY_INTERACTIVE_RESERVE': 5}, {'SPOTIFY_INTERACTIVE_RESERVE': -1}):
+            with self.subTest(**bad), override_settings(**bad), self.assertRaises(ImproperlyConfigured):
+                dispatch.check_settings()
+
+
+@override_settings(ADMISSION_USER_CONCURRENCY=1, ADMISSION_GLOBAL_CONCURRENCY=2, ADMISSION_RETRY_AFTER=7)
+class AdmissionControlTests(TestCase):
+    # A heavy view that streams (holding its slots until closed) and one that doesn't
+    stream_url = reverse('maps.api_library_geo')
+    heavy_url = reverse('maps.api_country_charts_batch') + '?countries=US'
+
+    def setUp(self):
+        cache.clear()
+        local_tier.clear()
+        # Served from the cache, so the batch never calls Spotify
+        CHARTS.set('US', value={'country_code': 'US', 'artists': []})
+        for target, value in (('maps.views.get_user_playlists', {'items': []}),
+                              ('maps.views._refresh_token_if_expired', None)):
+            patcher = mock.patch(target, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = self._client('alice')
+
+    def _client(self, username):
+        client = Client()
+        client.force_login(get_user_model().objects.create(username=username))
+        return client
+
+    def _open_stream(self, client):
+        response = client.get(self.stream_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.addCleanup(response.close)
+        return response
+
+    def test_request_over_the_users_cap_is_turned_away(self):
+        self._open_stream(self.client)
+
+        response = self.client.get(self.heavy_url)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '7')
+        self.assertIn('heavy requests running', response.json()['error'])
+
+    def test_request_over_the_global_cap_is_turned_away(self):
+        self._open_stream(self.client)
+        self._open_stream(self._client('bob'))
+
+        response = self._client('carol').get(self.heavy_url)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '7')
+        self.assertIn('server is busy', response.json()['error'])
+
+    def test_streamed_response_releases_its_slot_when_closed(self):
+        stream = self._open_stream(self.client)
+        self.assertEqual(self.client.get(self.heavy_url).status_code, 503)
+
+        # Closed before a single chunk was sent, as on an early disconnect
+        stream.close()
+
+        self.assertEqual(self.client.get(self.heavy_url).status_code, 200)
+
+    def test_plain_response_releases_its_slot(self):
+        self.assertEqual(self.client.get(self.heavy_url).status_code, 200)
+        self.assertEqual(self.client.get(self.heavy_url).status_code, 200)
+
+    def test_other_views_are_not_limited(self):
+        self._open_stream(self.client)
+        self.assertEqual(self.client.get(reverse('maps.api_chart_countries')).status_code, 200)
+
+    def test_cache_only_reads_are_not_limited(self):
+        self._open_stream(self.client)
+        self.assertEqual(self.client.get(self.heavy_url).status_code, 503)
+
+        self.assertEqual(self.client.get(self.heavy_url + '&cached=1').status_code, 200)
+        with mock.patch('maps.views.get_available_chart_countries', return_value=['US']):
+            self.assertEqual(self.client.get(reverse('maps.api_chart_similarity')).status_code, 200)
+
+    def test_heavy_requests_wait_out_a_spotify_rate_limit(self):
+        with mock.patch('accounts.admission.dispatcher.paused_for', return_value=2.5):
+            response = self.client.get(self.heavy_url)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '3')
+
+
+@override_settings(REPLICA_STICKY_SECONDS=30)
+class ReplicaRouterTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch('accounts.replica.replica_configured', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+        self.user = SimpleNamespace(pk=1, is_authenticated=True)
+
+    def _read_alias(self, method='get'):
+        """The database a @reporting view would read from."""
+        @reporting
+        def view(request):
+            return HttpResponse(self.router.db_for_read(None) or DEFAULT_DB_ALIAS)
+
+        request = getattr(self.factory, method)('/report/')
+        request.user = self.user
+        return view(request).content.decode()
+
+    def test_reporting_reads_go_to_the_replica(self):
+        self.assertEqual(self._read_alias(), REPLICA_ALIAS)
+        # Outside a reporting view everything stays on the primary
+        self.assertIsNone(self.router.db_for_read(None))
+
+    def test_reads_stick_to_the_primary_after_a_write(self):
+        stick_to_primary(self.user)
+        self.assertEqual(self._read_alias(), DEFAULT_DB_ALIAS)
+
+        # Other users keep reading from the replica
+        self.user = SimpleNamespace(pk=2, is_authenticated=True)
+        self.assertEqual(self._read_alias(), REPLICA_ALIAS)
+
+    def test_writes_and_unsafe_methods_use_the_primary(self):
+        self.assertEqual(self._read_alias('post'), DEFAULT_DB_ALIAS)
+        self.assertEqual(self.router.db_for_write(None), DEFAULT_DB_ALIAS)
+        self.assertFalse(self.router.allow_migrate(REPLICA_ALIAS, 'playlists'))
+        self.assertTrue(self.router.allow_migrate(DEFAULT_DB_ALIAS, 'playlists'))
+
+    def test_streamed_bodies_read_from_the_replica(self):
+        @reporting
+        def view(request):
+            return StreamingHttpResponse(self.router.db_for_read(None) for _ in range(2))
+
+        request = self.factory.get('/report/')
+        request.user = self.user
+        body = b''.join(view(request).streaming_content).decode()
+        self.assertEqual(body, REPLICA_ALIAS * 2)
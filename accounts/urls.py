@@ -10,5 +10,6 @@ urlpatterns = [
     path("spotify/connect/", views.connect_spotify, name="accounts.spotify_connect"),
     path("spotify/disconnect/", views.disconnect_spotify, name="accounts.spotify_disconnect"),
     path("spotify/callback/", views.spotify_callback, name="accounts.spotify_callback"),
+    path("cache-metrics/", views.cache_metrics, name="accounts.cache_metrics"),
     path("spotify/play-track/", play_track, name="spotify_play_track"),
 ]
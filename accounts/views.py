@@ -3,6 +3,8 @@ from django.contrib.auth import login as auth_login, authenticate, logout as aut
 from .forms import CustomUserCreationForm, CustomErrorList
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
 from django.conf import settings
 from django.urls import reverse
 from django.utils import timezone
@@ -10,6 +12,7 @@ from datetime import timedelta
 import requests
 from .models import SpotifyToken
 from .spotify import get_spotify_user_profile
+from .cache import cache_stats, invalidate_user
 from urllib.parse import urlencode
 import secrets
 import string
@@ -134,6 +137,8 @@ def spotify_callback(request):
                 'expires_at': expires_at,
             }
         )
+        # The user may have connected a different Spotify account
+        invalidate_user(request.user)
         return redirect('home.index')
     else:
         # Not logged in: store token data in session and prompt user to login/signup
@@ -150,8 +155,7 @@ def account(request):
     spotify_connected = False
     spotify_profile = None
     
-    try:
-        spotify_token = SpotifyToken.objects.get(user=request.user)
+    if request.spotify.connected:
         spotify_connected = True
         # Get Spotify profile info
         try:
@@ -159,8 +163,6 @@ def account(request):
         except Exception as e:
             # If we can't get profile (token expired, etc), still show as connected
             spotify_profile = None
-    except SpotifyToken.DoesNotExist:
-        spotify_connected = False
     
     template_data.update({
         'spotify_connected': spotify_connected,
@@ -178,8 +180,16 @@ def disconnect_spotify(request):
         spotify_token.delete()
     except SpotifyToken.DoesNotExist:
         pass  # Already disconnected
+    invalidate_user(request.user)
     
     return redirect('accounts.account')
 
 
+
+@staff_member_required
+def cache_metrics(request):
+    """Cache hit/miss counts per namespace for this worker process."""
+    return JsonResponse({'namespaces': cache_stats()})
+
+
 # Create your views here.
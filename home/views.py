@@ -1,11 +1,10 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
-from accounts.models import SpotifyToken
 
 def index(request):
     """Home page. If logged in and connected to Spotify, go straight to playlists."""
     if request.user.is_authenticated:
-        if SpotifyToken.objects.filter(user=request.user).exists():
+        if request.spotify.connected:
             return redirect('playlists.dashboard')
         else:
             # Logged in but not connected to Spotify
@@ -0,0 +1,178 @@
+"""Set-based comparison of playlists and country charts.
+
+Charts and playlists are reduced to two sets each, normalized artist names and
+Spotify track ids, so the overlap with every chart country is a handful of set
+intersections instead of a join the browser has to do itself. The same sets,
+integer-coded, give the country x country chart similarity matrix.
+"""
+import hashlib
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+from accounts.cache import CHART_SIMILARITY
+from playlists.normalize import artist_key
+
+
+class TrackSets:
+    """Artist keys and track ids of a track collection.
+
+    ``artist_names`` maps each normalized key back to the first display name
+    seen, so shared artists can be reported as Spotify spells them.
+    """
+
+    def __init__(self, artist_names: Dict[str, str], track_ids: frozenset):
+        self.artist_names = artist_names
+        self.artists = frozenset(artist_names)
+        self.tracks = track_ids
+
+    @classmethod
+    def from_items(cls, items: Iterable[dict]) -> 'TrackSets':
+        """Build from playlist track items as returned by Spotify."""
+        artist_names: Dict[str, str] = {}
+        track_ids = set()
+        for item in items:
+            track = (item or {}).get('track')
+            if not track:
+                continue
+            if track.get('id'):
+                track_ids.add(track['id'])
+            for artist in track.get('artists') or []:
+                name = artist.get('name')
+                if name:
+                    artist_names.setdefault(artist_key(name), name)
+        return cls(artist_names, frozenset(track_ids))
+
+    @classmethod
+    def from_chart(cls, chart: dict) -> 'TrackSets':
+        """Build from a chart payload as returned by get_top_charts_for_country."""
+        artist_names: Dict[str, str] = {}
+        track_ids = set()
+        for track in chart.get('tracks') or []:
+            if track.get('id'):
+                track_ids.add(track['id'])
+            for name in track.get('artists') or []:
+                artist_names.setdefault(artist_key(name), name)
+        return cls(artist_names, frozenset(track_ids))
+
+    def overlap(self, chart: 'TrackSets', limit: int = 10) -> dict:
+        """Overlap of this collection with ``chart``.
+
+        ``jaccard`` is computed over artists, ``track_jaccard`` over tracks.
+        Shared artists are listed in alphabetical order, at most ``limit``.
+        """
+        shared_artists = self.artists & chart.artists
+        shared_tracks = self.tracks & chart.tracks
+        artist_union = len(self.artists) + len(chart.artists) - len(shared_artists)
+        track_union = len(self.tracks) + len(chart.tracks) - len(shared_tracks)
+        return {
+            'shared_artist_count': len(shared_artists),
+            'shared_track_count': len(shared_tracks),
+            'shared_artists': sorted((chart.artist_names[k] for k in shared_artists), key=str.casefold)[:limit],
+            'jaccard': round(len(shared_artists) / artist_union, 4) if artist_union else 0.0,
+            'track_jaccard': round(len(shared_tracks) / track_union, 4) if track_union else 0.0,
+        }
+
+
+def rank_markets(playlist: TrackSets, charts: Dict[str, dict]) -> List[dict]:
+    """Overlap with every chart, most similar market first.
+
+    Markets are ordered by artist Jaccard, then shared tracks, then country code.
+    Charts that failed to load are left out.
+    """
+    ranked = []
+    for code, chart in charts.items():
+        if chart.get('error'):
+            continue
+        entry = playlist.overlap(TrackSets.from_chart(chart))
+        entry['country_code'] = code
+        entry['has_chart'] = chart.get('has_chart', False)
+        ranked.append(entry)
+    ranked.sort(key=lambda e: (-e['jaccard'], -e['shared_track_count'], e['country_code']))
+    return ranked
+
+
+def chart_version(charts: Dict[str, dict]) -> str:
+    """Digest of the charts' contents (countries and track ids in rank order).
+
+    Unchanged charts keep their version across cache refreshes, so anything
+    derived from them only needs recomputing when a chart actually moves.
+    """
+    digest = hashlib.sha1()
+    for code in sorted(charts):
+        digest.update(code.encode())
+        for track in charts[code].get('tracks') or []:
+            digest.update(b'\0' + (track.get('id') or '').encode())
+        digest.update(b'\n')
+    return digest.hexdigest()[:16]
+
+
+def _jaccard_matrix(incidence: np.ndarray) -> np.ndarray:
+    """Pairwise Jaccard similarity between the rows of a boolean matrix."""
+    counts = incidence.astype(np.int32)
+    shared = counts @ counts.T
+    sizes = counts.sum(axis=1)
+    union = sizes[:, None] + sizes[None, :] - shared
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(union > 0, shared / union, 0.0).astype(np.float32)
+
+
+class SimilarityMatrix:
+    """Country x country chart similarity, by shared artists and shared tracks.
+
+    Artists and tracks are integer-coded across all charts, each chart becomes
+    a boolean row over those codes, and both Jaccard matrices fall out of one
+    matrix product per kind.
+    """
+
+    def __init__(self, countries: List[str], artist_jaccard: np.ndarray,
+                 track_jaccard: np.ndarray, version: str):
+        self.countries = countries
+        self.artist_jaccard = artist_jaccard
+        self.track_jaccard = track_jaccard
+        self.version = version
+
+    @classmethod
+    def from_charts(cls, charts: Dict[str, dict]) -> 'SimilarityMatrix':
+        """Build from chart payloads keyed by country; failed charts are skipped."""
+        charts = {code: chart for code, chart in charts.items() if not chart.get('error')}
+        countries = sorted(charts)
+        artist_codes: Dict[str, int] = {}
+        track_codes: Dict[str, int] = {}
+        artist_rows, track_rows = [], []
+        for code in countries:
+            sets = TrackSets.from_chart(charts[code])
+            artist_rows.append([artist_codes.setdefault(a, len(artist_codes)) for a in sets.artists])
+            track_rows.append([track_codes.setdefault(t, len(track_codes)) for t in sets.tracks])
+
+        def incidence(rows, width):
+            matrix = np.zeros((len(rows), width), dtype=bool)
+            for i, cols in enumerate(rows):
+                matrix[i, cols] = True
+            return matrix
+
+        return cls(
+            countries,
+            _jaccard_matrix(incidence(artist_rows, len(artist_codes))),
+            _jaccard_matrix(incidence(track_rows, len(track_codes))),
+            chart_version(charts),
+        )
+
+    def to_payload(self, precision: int = 4) -> dict:
+        return {
+            'version': self.version,
+            'countries': self.countries,
+            'artist_jaccard': np.round(self.artist_jaccard.astype(float), precision).tolist(),
+            'track_jaccard': np.round(self.track_jaccard.astype(float), precision).tolist(),
+        }
+
+    def to_bytes(self) -> bytes:
+        """Both matrices quantized to uint8 (0-255 = 0.0-1.0), artists first, row-major."""
+        quantized = np.rint(np.stack([self.artist_jaccard, self.track_jaccard]) * 255)
+        return quantized.astype(np.uint8).tobytes()
+
+
+def chart_similarity(charts: Dict[str, dict]) -> SimilarityMatrix:
+    """The similarity matrix of ``charts``, built once per chart version."""
+    charts = {code: chart for code, chart in charts.items() if not chart.get('error')}
+    return CHART_SIMILARITY.get_or_set(chart_version(charts), compute=lambda: SimilarityMatrix.from_charts(charts))
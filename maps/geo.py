@@ -0,0 +1,257 @@
+"""Vectorized geo aggregation for playlist tracks.
+
+Each track's available markets become one row of a boolean market matrix over a
+fixed market index (SPOTIFY_MARKETS first, then any extra codes Spotify
+returns), and artists are integer-coded. Per-country artist counts are a single
+grouped reduction over that matrix, and the top artists per country come from a
+partial selection instead of fully sorting every country's artist dict.
+"""
+from typing import Dict, Iterable, List, Set
+
+import numpy as np
+
+
+SPOTIFY_MARKETS: Set[str] = set([
+    # Spotify supported market codes as of 2024/2025 (ISO 3166-1 alpha-2)
+    'AD','AE','AF','AG','AL','AM','AO','AR','AT','AU','AZ','BA','BB','BD','BE','BF','BG','BH','BI','BJ','BN','BO','BR','BS','BT','BW','BY','BZ',
+    'CA','CD','CG','CH','CI','CL','CM','CO','CR','CV','CW','CY','CZ',
+    'DE','DJ','DK','DM','DO','DZ',
+    'EC','EE','EG','ES','ET',
+    'FI','FJ','FM','FR',
+    'GA','GB','GD','GE','GH','GM','GN','GQ','GR','GT','GW','GY',
+    'HK','HN','HR','HT','HU',
+    'ID','IE','IL','IN','IQ','IS','IT',
+    'JM','JO','JP',
+    'KE','KG','KH','KI','KM','KN','KR','KW','KZ',
+    'LA','LB','LC','LI','LK','LR','LS','LT','LU','LV','LY',
+    'MA','MC','MD','ME','MG','MH','MK','ML','MM','MN','MO','MR','MT','MU','MV','MW','MX','MY','MZ',
+    'NA','NE','NG','NI','NL','NO','NP','NR','NZ',
+    'OM',
+    'PA','PE','PG','PH','PK','PL','PS','PT','PW','PY',
+    'QA',
+    'RO','RS','RU','RW',
+    'SA','SB','SC','SE','SG','SI','SK','SL','SM','SN','SO','SR','ST','SV','SZ',
+    'TD','TG','TH','TJ','TL','TN','TO','TR','TT','TV','TW','TZ',
+    'UA','UG','US','UY','UZ',
+    'VC','VE','VN','VU',
+    'WS',
+    'XK',
+    'ZA','ZM','ZW'
+])
+
+
+# Fixed market order: the bit position of each market in a track's bitset
+MARKET_CODES: List[str] = sorted(SPOTIFY_MARKETS)
+
+
+class GeoAggregate:
+    """Artist x market appearance counts for a set of tracks.
+
+    ``counts[a, m]`` is the number of tracks by artist ``a`` available in market
+    ``markets[m]``, and ``first_seen[a, m]`` the position of the first of those
+    (track, artist) pairs among the ``seen`` pairs aggregated. Aggregates over
+    different track sets can be merged.
+    """
+
+    def __init__(self, markets: List[str], artist_names: List[str], counts: np.ndarray,
+                 first_seen: np.ndarray, seen: int):
+        self.markets = markets
+        self.artist_names = artist_names
+        self.counts = counts
+        self.first_seen = first_seen
+        self.seen = seen
+
+    @classmethod
+    def empty(cls) -> 'GeoAggregate':
+        shape = (0, len(MARKET_CODES))
+        return cls(list(MARKET_CODES), [], np.zeros(shape, dtype=np.int32), np.zeros(shape, dtype=np.int64), 0)
+
+    @classmethod
+    def from_items(cls, items: Iterable[dict]) -> 'GeoAggregate':
+        """Build an aggregate from playlist track items as returned by Spotify.
+
+        Tracks without named artists are ignored, as they always were.
+        """
+        markets = list(MARKET_CODES)
+        market_index = {code: i for i, code in enumerate(markets)}
+        artist_index: Dict[str, int] = {}
+        artist_names: List[str] = []
+
+        # Tracks mostly share a handful of market lists, so each distinct list
+        # is converted to bit positions once and tracks refer to it by id
+        market_sets: Dict[tuple, int] = {}
+        market_set_bits: List[List[int]] = []
+        track_market_set = []
+        pair_tracks = []
+        pair_artists = []
+
+        for item in items:
+            track = (item or {}).get('track') or {}
+            if not track:
+                continue
+            names = [a.get('name') for a in track.get('artists') or [] if a.get('name')]
+            if not names:
+                continue
+            key = tuple(track.get('available_markets') or ())
+            set_id = market_sets.get(key)
+            if set_id is None:
+                bits = []
+                for code in key:
+                    if not code:
+                        continue
+                    if code not in market_index:
+                        market_index[code] = len(markets)
+                        markets.append(code)
+                    bits.append(market_index[code])
+                set_id = market_sets[key] = len(market_set_bits)
+                market_set_bits.append(bits)
+            row = len(track_market_set)
+            track_market_set.append(set_id)
+            for name in names:
+                code = artist_index.get(name)
+                if code is None:
+                    code = artist_index[name] = len(artist_names)
+                    artist_names.append(name)
+                pair_tracks.append(row)
+                pair_artists.append(code)
+
+        # Bitset of every distinct market list, then one row per track
+        set_matrix = np.zeros((len(market_set_bits), len(markets)), dtype=np.bool_)
+        for set_id, bits in enumerate(market_set_bits):
+            set_matrix[set_id, bits] = True
+        track_markets = set_matrix[np.asarray(track_market_set, dtype=np.intp)]
+
+        seen = len(pair_artists)
+        counts = np.zeros((len(artist_names), len(markets)), dtype=np.int32)
+        first_seen = np.full(counts.shape, seen, dtype=np.int64)
+        if pair_artists:
+            pair_artists = np.asarray(pair_artists, dtype=np.intp)
+            pair_tracks = np.asarray(pair_tracks, dtype=np.intp)
+            # Group (track, artist) pairs by artist and sum their market rows
+            order = np.argsort(pair_artists, kind='stable')
+            sorted_artists = pair_artists[order]
+            starts = np.flatnonzero(np.r_[True, sorted_artists[1:] != sorted_artists[:-1]])
+            available = track_markets[pair_tracks[order]]
+            counts[sorted_artists[starts]] = np.add.reduceat(available.astype(np.int32), starts, axis=0)
+            # Earliest pair per artist that is available in each market
+            positions = np.where(available, order[:, None].astype(np.int64), seen)
+            first_seen[sorted_artists[starts]] = np.minimum.reduceat(positions, starts, axis=0)
+        return cls(markets, artist_names, counts, first_seen, seen)
+
+    def merge(self, other: 'GeoAggregate') -> 'GeoAggregate':
+        """Combine two aggregates, aligning artists by name and markets by code."""
+        accumulator = GeoAccumulator()
+        accumulator.add(self)
+        accumulator.add(other)
+        return accumulator.aggregate()
+
+    def presence_mask(self) -> np.ndarray:
+        """Boolean vector over ``markets``: True where any track is available."""
+        return self.counts.any(axis=0)
+
+    def presence(self) -> List[str]:
+        mask = self.presence_mask()
+        return sorted(code for code, present in zip(self.markets, mask) if present)
+
+    def top_artists(self, k: int = 5) -> Dict[str, List[dict]]:
+        """Top ``k`` artists per present market, most frequent first.
+
+        Ties go to the artist whose track came first among that market's
+        tracks. Selection is a partial partition over every market column at
+        once rather than a full sort per country.
+        """
+        n_artists = len(self.artist_names)
+        if n_artists == 0:
+            return {}
+        # Unique sort key per (artist, market): count first, earlier first track wins ties
+        seen = self.seen + 1
+        first_seen = np.where(self.counts > 0, self.first_seen, seen - 1)
+        keys = self.counts.astype(np.int64) * seen + (seen - 1 - first_seen)
+        k = min(k, n_artists)
+        top = np.argpartition(-keys, k - 1, axis=0)[:k]
+        top_keys = np.take_along_axis(keys, top, axis=0)
+        top = np.take_along_axis(top, np.argsort(-top_keys, axis=0), axis=0)
+
+        result = {}
+        for m in np.flatnonzero(self.presence_mask()):
+            result[self.markets[m]] = [
+                {"name": self.artist_names[a], "count": int(self.counts[a, m])}
+                for a in top[:, m] if self.counts[a, m] > 0
+            ]
+        return result
+
+    def to_payload(self, k: int = 5) -> dict:
+        """The api_playlist_geo JSON body."""
+        presence = self.presence()
+        return {
+            "presence_iso2": presence,
+            "absence_iso2": sorted(SPOTIFY_MARKETS - set(presence)),
+            "top_artists": self.top_artists(k),
+        }
+
+
+class GeoAccumulator:
+    """Merges a stream of aggregates in place.
+
+    Chaining ``merge`` copies everything merged so far each time; this keeps
+    the counts in arrays that grow by doubling, so adding an aggregate costs
+    about as much as the aggregate itself.
+    """
+
+    _NOT_SEEN = np.iinfo(np.int64).max
+
+    def __init__(self):
+        self.markets = list(MARKET_CODES)
+        self.market_index = {code: i for i, code in enumerate(self.markets)}
+        self.artist_names: List[str] = []
+        self.artist_index: Dict[str, int] = {}
+        self.seen = 0
+        self._counts = np.zeros((64, len(self.markets)), dtype=np.int32)
+        self._first_seen = np.full(self._counts.shape, self._NOT_SEEN, dtype=np.int64)
+
+    def _reserve(self, rows: int, cols: int):
+        capacity = self._counts.shape
+        if rows <= capacity[0] and cols <= capacity[1]:
+            return
+        shape = list(capacity)
+        while shape[0] < rows:
+            shape[0] *= 2
+        while shape[1] < cols:
+            shape[1] *= 2
+        counts = np.zeros(shape, dtype=np.int32)
+        first_seen = np.full(shape, self._NOT_SEEN, dtype=np.int64)
+        counts[:capacity[0], :capacity[1]] = self._counts
+        first_seen[:capacity[0], :capacity[1]] = self._first_seen
+        self._counts, self._first_seen = counts, first_seen
+
+    def add(self, other: GeoAggregate):
+        """Add ``other``'s tracks after those added so far."""
+        for code in other.markets:
+            if code not in self.market_index:
+                self.market_index[code] = len(self.markets)
+                self.markets.append(code)
+        rows = np.empty(len(other.artist_names), dtype=np.intp)
+        for i, name in enumerate(other.artist_names):
+            row = self.artist_index.get(name)
+            if row is None:
+                row = self.artist_index[name] = len(self.artist_names)
+                self.artist_names.append(name)
+            rows[i] = row
+        self._reserve(len(self.artist_names), len(self.markets))
+
+        if other.counts.size:
+            cols = np.array([self.market_index[c] for c in other.markets], dtype=np.intp)
+            block = np.ix_(rows, cols)
+            self._counts[block] += other.counts
+            other_first = np.where(other.counts > 0, other.first_seen + self.seen, self._NOT_SEEN)
+            self._first_seen[block] = np.minimum(self._first_seen[block], other_first)
+        self.seen += other.seen
+
+    def aggregate(self) -> GeoAggregate:
+        """Everything added so far. Shares the accumulator's arrays, so use it
+        before the next ``add``."""
+        shape = (len(self.artist_names), len(self.markets))
+        return GeoAggregate(
+            list(self.markets), list(self.artist_names),
+            self._counts[:shape[0], :shape[1]], self._first_seen[:shape[0], :shape[1]], self.seen,
+        )
@@ -0,0 +1,48 @@
+"""Trend queries over captured chart history (see ChartEntry.capture).
+
+Everything here reads the local ChartEntry table; no Spotify calls.
+"""
+from datetime import date, timedelta
+from typing import List, Optional
+
+from django.db.models import Min
+
+from playlists.normalize import artist_key
+
+from .models import ChartEntry
+
+
+def _streak_until(days: List[date], last_day: date) -> int:
+    """Length of the run of consecutive days in ``days`` ending at ``last_day``."""
+    present = set(days)
+    streak = 0
+    while last_day - timedelta(days=streak) in present:
+        streak += 1
+    return streak
+
+
+def chart_trend(country: str, artist: Optional[str] = None, track_id: Optional[str] = None) -> dict:
+    """How an artist or track has charted in ``country`` over the captured days.
+
+    Returns the per-day best rank in date order plus first/last day seen, the
+    number of days charted, the best rank overall and the current streak
+    (consecutive days up to the latest capture for the country).
+    """
+    entries = ChartEntry.objects.filter(country=country)
+    if track_id:
+        entries = entries.filter(track__spotify_id=track_id)
+    else:
+        entries = entries.filter(track__artists__normalized_name=artist_key(artist or ''))
+
+    series = list(entries.values('day').annotate(best_rank=Min('rank')).order_by('day'))
+    latest_capture = ChartEntry.objects.filter(country=country).order_by('-day').values_list('day', flat=True).first()
+    days = [row['day'] for row in series]
+    return {
+        'country_code': country,
+        'days_charting': len(days),
+        'first_seen': days[0].isoformat() if days else None,
+        'last_seen': days[-1].isoformat() if days else None,
+        'best_rank': min((row['best_rank'] for row in series), default=None),
+        'current_streak': _streak_until(days, latest_capture) if latest_capture else 0,
+        'series': [{'day': row['day'].isoformat(), 'rank': row['best_rank']} for row in series],
+    }
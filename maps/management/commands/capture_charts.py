@@ -0,0 +1,61 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from accounts.cache import CHARTS
+from accounts.dispatch import Priority, priority
+from accounts.spotify import get_available_chart_countries, get_top_charts_for_country
+from maps.charts import chart_similarity
+from maps.models import ChartEntry
+
+
+class Command(BaseCommand):
+    help = ("Capture today's Top 50 chart for every chart country into the local "
+            "chart history, refresh the shared chart cache and rebuild the chart "
+            "similarity matrix from it. Meant to run once a day from cron or a "
+            "scheduler.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True,
+                            help='Username whose Spotify token is used for the chart requests.')
+        parser.add_argument('--countries', default='',
+                            help='Comma-separated country codes (default: every chart country).')
+
+    def handle(self, *args, user, countries, **options):
+        try:
+            account = get_user_model().objects.get(username=user)
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"No user named {user!r}")
+
+        chart_countries = [c for c in get_available_chart_countries() if c != 'GLOBAL']
+        codes = [c.strip().upper() for c in countries.split(',') if c.strip()] or chart_countries
+        day = timezone.localdate()
+
+        captured = 0
+        for code in codes:
+            try:
+                with priority(Priority.BULK):
+                    chart = get_top_charts_for_country(account, code)
+            except Exception as e:
+                self.stderr.write(f"{code}: {e}")
+                continue
+            if not chart.get('error'):
+                CHARTS.set(code, value=chart)
+            # Countries without their own chart fall back to Global; don't file that under the country
+            if chart.get('error') or not chart.get('has_chart'):
+                self.stderr.write(f"{code}: no chart available")
+                continue
+            stored = ChartEntry.capture(code, day, chart.get('tracks') or [])
+            captured += 1
+            self.stdout.write(f"{code}: {stored} positions")
+
+        # api_chart_similarity only serves what is cached; build it here, off the request path
+        charts = {
+            code: chart for (code,), chart
+            in CHARTS.get_many(((c,) for c in chart_countries), allow_stale=True).items()
+        }
+        if charts:
+            matrix = chart_similarity(charts)
+            self.stdout.write(f"Chart similarity {matrix.version}: {len(matrix.countries)} countries")
+
+        self.stdout.write(self.style.SUCCESS(f"Captured {captured} of {len(codes)} charts for {day}"))
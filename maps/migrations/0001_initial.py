@@ -0,0 +1,48 @@
+# Generated by Django 5.0 on 2026-10-19 15:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChartArtist',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=512)),
+                ('normalized_name', models.CharField(max_length=512, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChartTrack',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('spotify_id', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(blank=True, max_length=512)),
+                ('artists', models.ManyToManyField(blank=True, related_name='tracks', to='maps.chartartist')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChartEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('country', models.CharField(max_length=8)),
+                ('day', models.DateField()),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('track', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='maps.charttrack')),
+            ],
+            options={
+                'verbose_name_plural': 'Chart entries',
+                'ordering': ('country', 'day', 'rank'),
+                'indexes': [models.Index(fields=['country', 'track', 'day'], name='chart_entry_track_idx')],
+                'unique_together': {('country', 'day', 'rank')},
+            },
+        ),
+    ]
@@ -0,0 +1,84 @@
+from django.db import models, transaction
+
+from playlists.normalize import artist_key
+
+
+class ChartArtist(models.Model):
+	"""An artist seen in a captured chart, coded by normalized name."""
+	name = models.CharField(max_length=512)
+	normalized_name = models.CharField(max_length=512, unique=True)
+
+	def __str__(self):
+		return self.name
+
+
+class ChartTrack(models.Model):
+	"""A track seen in a captured chart."""
+	spotify_id = models.CharField(max_length=64, unique=True)
+	name = models.CharField(max_length=512, blank=True)
+	artists = models.ManyToManyField(ChartArtist, related_name='tracks', blank=True)
+
+	def __str__(self):
+		return self.name or self.spotify_id
+
+
+class ChartEntry(models.Model):
+	"""One chart position: ``track`` at ``rank`` in ``country``'s chart on ``day``."""
+	country = models.CharField(max_length=8)
+	day = models.DateField()
+	rank = models.PositiveSmallIntegerField()
+	track = models.ForeignKey(ChartTrack, on_delete=models.CASCADE, related_name='entries')
+
+	class Meta:
+		unique_together = ("country", "day", "rank")
+		indexes = [models.Index(fields=["country", "track", "day"], name="chart_entry_track_idx")]
+		ordering = ("country", "day", "rank")
+		verbose_name_plural = "Chart entries"
+
+	def __str__(self):
+		return f"{self.country} {self.day} #{self.rank}"
+
+	@classmethod
+	def capture(cls, country, day, tracks):
+		"""Store one country's chart for ``day``, replacing any earlier capture.
+
+		``tracks`` are chart tracks in rank order as returned by
+		get_top_charts_for_country (id, name, artist names). Ranks are chart
+		positions, so local or unavailable tracks without an id leave a gap
+		instead of shifting the tracks after them. Returns the number of
+		positions stored.
+		"""
+		positions = [(rank, t) for rank, t in enumerate(tracks, start=1) if t.get('id')]
+		tracks = [t for _, t in positions]
+		names = {}
+		for track in tracks:
+			for name in track.get('artists') or []:
+				names.setdefault(artist_key(name), name)
+
+		with transaction.atomic():
+			ChartArtist.objects.bulk_create(
+				[ChartArtist(name=name, normalized_name=key) for key, name in names.items()],
+				ignore_conflicts=True,
+			)
+			ChartTrack.objects.bulk_create(
+				[ChartTrack(spotify_id=t['id'], name=t.get('name') or '') for t in tracks],
+				update_conflicts=True,
+				unique_fields=['spotify_id'],
+				update_fields=['name'],
+			)
+			artist_ids = dict(ChartArtist.objects.filter(normalized_name__in=names).values_list('normalized_name', 'id'))
+			track_ids = dict(ChartTrack.objects.filter(spotify_id__in=[t['id'] for t in tracks]).values_list('spotify_id', 'id'))
+
+			ChartTrack.artists.through.objects.bulk_create(
+				[
+					ChartTrack.artists.through(charttrack_id=track_ids[t['id']], chartartist_id=artist_ids[artist_key(name)])
+					for t in tracks for name in t.get('artists') or []
+				],
+				ignore_conflicts=True,
+			)
+			cls.objects.filter(country=country, day=day).delete()
+			cls.objects.bulk_create([
+				cls(country=country, day=day, rank=rank, track_id=track_ids[t['id']])
+				for rank, t in positions
+			])
+		return len(tracks)
@@ -0,0 +1,222 @@
+import json
+import random
+from datetime import date
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from accounts.dispatch import Priority, current_priority
+
+from .geo import GeoAccumulator, GeoAggregate
+from .history import chart_trend
+from .models import ChartEntry
+from .views import _library_geo_lines, _playlist_geo_events
+
+
+def _chart_track(track_id, *artists):
+    return {'id': track_id, 'name': f'Track {track_id}', 'artists': list(artists)}
+
+
+class ChartCaptureTests(TestCase):
+
+    def test_ranks_are_chart_positions_around_tracks_without_id(self):
+        tracks = [
+            _chart_track('t1', 'A'),
+            {'id': None, 'name': 'Local file', 'artists': ['Nobody']},
+            _chart_track('t3', 'B'),
+            _chart_track('t4', 'A', 'C'),
+        ]
+
+        stored = ChartEntry.capture('US', date(2026, 1, 1), tracks)
+
+        self.assertEqual(stored, 3)
+        ranks = dict(ChartEntry.objects.values_list('track__spotify_id', 'rank'))
+        self.assertEqual(ranks, {'t1': 1, 't3': 3, 't4': 4})
+
+    def test_recapture_replaces_the_day(self):
+        ChartEntry.capture('US', date(2026, 1, 1), [_chart_track('t1', 'A'), _chart_track('t2', 'B')])
+        ChartEntry.capture('US', date(2026, 1, 1), [{'id': '', 'artists': []}, _chart_track('t2', 'B')])
+
+        self.assertEqual(list(ChartEntry.objects.values_list('track__spotify_id', 'rank')), [('t2', 2)])
+
+    def test_trend_reports_chart_positions(self):
+        ChartEntry.capture('US', date(2026, 1, 1), [{'id': None}, _chart_track('t1', 'Anitta')])
+        ChartEntry.capture('US', date(2026, 1, 2), [_chart_track('t1', 'Anitta')])
+
+        trend = chart_trend('US', artist='anitta')
+
+        self.assertEqual(trend['best_rank'], 1)
+        self.assertEqual(trend['series'], [{'day': '2026-01-01', 'rank': 2}, {'day': '2026-01-02', 'rank': 1}])
+        self.assertEqual(trend['current_streak'], 2)
+
+
+def _baseline_top_artists(items, k=5):
+    """Top artists per country as api_playlist_geo computed them with dicts."""
+    by_country = {}
+    for item in items:
+        track = (item or {}).get('track') or {}
+        if not track:
+            continue
+        names = [a.get('name') for a in track.get('artists') or [] if a.get('name')]
+        if not names:
+            continue
+        for market in track.get('available_markets') or []:
+            if not market:
+                continue
+            bucket = by_country.setdefault(market, {})
+            for name in names:
+                bucket[name] = bucket.get(name, 0) + 1
+    return {
+        market: [{'name': name, 'count': count}
+                 for name, count in sorted(artists.items(), key=lambda kv: kv[1], reverse=True)[:k]]
+        for market, artists in by_country.items()
+    }
+
+
+def _random_items(rng, count):
+    markets = ['US', 'GB', 'DE', 'BR', 'JP', 'XX']
+    items = []
+    for _ in range(count):
+        artists = [{'name': f'artist {rng.randint(0, 12)}'} for _ in range(rng.randint(0, 3))]
+        items.append({'track': {'artists': artists, 'available_markets': rng.sample(markets, rng.randint(0, 6))}})
+    items.append(None)
+    items.append({'track': None})
+    return items
+
+
+class GeoAggregateTests(SimpleTestCase):
+
+    def test_top_artists_match_the_dict_implementation(self):
+        rng = random.Random(34)
+        for _ in range(300):
+            items = _random_items(rng, rng.randint(0, 40))
+            self.assertEqual(GeoAggregate.from_items(items).top_artists(), _baseline_top_artists(items))
+
+    def test_ties_go_to_the_first_artist_seen_in_each_market(self):
+        items = [
+            {'track': {'artists': [{'name': 'B'}], 'available_markets': ['GB']}},
+            {'track': {'artists': [{'name': 'A'}], 'available_markets': ['US', 'GB']}},
+            {'track': {'artists': [{'name': 'B'}], 'available_markets': ['US']}},
+        ]
+        top = GeoAggregate.from_items(items).top_artists()
+        # B is seen first overall, but A is seen first in the US
+        self.assertEqual([a['name'] for a in top['US']], ['A', 'B'])
+        self.assertEqual([a['name'] for a in top['GB']], ['B', 'A'])
+
+    def test_merged_aggregates_match_one_over_all_items(self):
+        rng = random.Random(35)
+        for _ in range(200):
+            chunks = [_random_items(rng, rng.randint(0, 20)) for _ in range(rng.randint(1, 4))]
+            merged = GeoAggregate.empty()
+            for chunk in chunks:
+                merged = merged.merge(GeoAggregate.from_items(chunk))
+            everything = [item for chunk in chunks for item in chunk]
+            self.assertEqual(merged.top_artists(), _baseline_top_artists(everything))
+            self.assertEqual(merged.presence(), GeoAggregate.from_items(everything).presence())
+
+    def test_payload_lists_presence_and_absence(self):
+        items = [{'track': {'artists': [{'name': 'A'}], 'available_markets': ['US', 'ZZ']}}]
+        payload = GeoAggregate.from_items(items).to_payload()
+        self.assertEqual(payload['presence_iso2'], ['US', 'ZZ'])
+        self.assertIn('GB', payload['absence_iso2'])
+        self.assertNotIn('US', payload['absence_iso2'])
+
+    def test_accumulator_matches_chained_merges(self):
+        rng = random.Random(36)
+        chunks = [_random_items(rng, rng.randint(0, 30)) for _ in range(150)]
+        accumulator = GeoAccumulator()
+        merged = GeoAggregate.empty()
+        for chunk in chunks:
+            partial = GeoAggregate.from_items(chunk)
+            accumulator.add(partial)
+            merged = merged.merge(partial)
+        self.assertEqual(accumulator.aggregate().to_payload(), merged.to_payload())
+
+
+class LibraryGeoLinesTests(SimpleTestCase):
+
+    def setUp(self):
+        rng = random.Random(41)
+        self.playlists = [{'id': f'p{i}', 'items': _random_items(rng, 10)} for i in range(20)]
+        patcher = mock.patch('maps.views._fetch_geo_partial',
+                             side_effect=lambda user, playlist: GeoAggregate.from_items(playlist['items']))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _lines(self):
+        return [json.loads(line) for line in _library_geo_lines(None, self.playlists)]
+
+    @override_settings(STREAM_PROGRESS_INTERVAL=3600)
+    def test_progress_is_throttled_and_the_result_always_sent(self):
+        lines = self._lines()
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0]['complete'])
+        everything = [item for p in self.playlists for item in p['items']]
+        expected = GeoAggregate.from_items(everything).to_payload()
+        # Playlists finish in any order, which can reorder tied artists
+        self.assertEqual(lines[0]['geo']['presence_iso2'], expected['presence_iso2'])
+        for market, artists in expected['top_artists'].items():
+            counts = [a['count'] for a in lines[0]['geo']['top_artists'][market]]
+            self.assertEqual(counts, [a['count'] for a in artists])
+
+    @override_settings(STREAM_PROGRESS_INTERVAL=0)
+    def test_progress_lines_without_throttling(self):
+        lines = self._lines()
+        self.assertEqual([line['done'] for line in lines], list(range(1, 20)) + [20])
+        self.assertEqual([line.get('complete') for line in lines], [None] * 19 + [True])
+
+
+class PlaylistGeoEventsTests(SimpleTestCase):
+
+    def setUp(self):
+        rng = random.Random(42)
+        self.pages = [{'items': _random_items(rng, 10), 'next': 'more', 'total': 50} for _ in range(5)]
+        self.pages[-1]['next'] = None
+        patcher = mock.patch('maps.views.iter_playlist_track_pages', return_value=iter(self.pages))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _events(self):
+        return [event.split('\n')[0] for event in _playlist_geo_events(None, 'p1', '')]
+
+    @override_settings(STREAM_PROGRESS_INTERVAL=3600)
+    def test_progress_is_throttled(self):
+        self.assertEqual(self._events(), ['event: done'])
+
+    @override_settings(STREAM_PROGRESS_INTERVAL=0)
+    def test_progress_per_page_without_throttling(self):
+        self.assertEqual(self._events(), ['event: progress'] * 4 + ['event: done'])
+
+
+class ChartOverlapTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create(username='alice'))
+        self.priorities = []
+
+        def resolve(user, codes):
+            self.priorities.append(current_priority())
+            return {code: {'tracks': []} for code in codes}
+
+        for target, kwargs in (
+            ('maps.views.get_playlist', {'return_value': {'id': 'p1', 'snapshot_id': 's1'}}),
+            ('maps.views._playlist_track_sets', {'return_value': mock.Mock()}),
+            ('maps.views.get_available_chart_countries', {'return_value': ['GLOBAL', 'US', 'GB']}),
+            ('maps.views.rank_markets', {'return_value': [{'country_code': 'US'}]}),
+            ('maps.views._resolve_charts', {'side_effect': resolve}),
+        ):
+            patcher = mock.patch(target, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_all_countries_are_fetched_in_the_background(self):
+        response = self.client.get(reverse('maps.api_chart_overlap'), {'playlist_id': 'p1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.priorities, [Priority.BACKGROUND])
+
+    def test_one_country_is_fetched_interactively(self):
+        response = self.client.get(reverse('maps.api_chart_overlap'), {'playlist_id': 'p1', 'country': 'us'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.priorities, [Priority.INTERACTIVE])
@@ -5,6 +5,12 @@ urlpatterns = [
     path('', views.map_view, name='maps.view'),
     path('api/playlists/', views.api_playlists, name='maps.api_playlists'),
     path('api/playlist-geo/', views.api_playlist_geo, name='maps.api_playlist_geo'),
+    path('api/playlist-geo/events/', views.api_playlist_geo_events, name='maps.api_playlist_geo_events'),
+    path('api/library-geo/', views.api_library_geo, name='maps.api_library_geo'),
     path('api/country-charts/', views.api_country_charts, name='maps.api_country_charts'),
+    path('api/country-charts/batch/', views.api_country_charts_batch, name='maps.api_country_charts_batch'),
+    path('api/chart-overlap/', views.api_chart_overlap, name='maps.api_chart_overlap'),
+    path('api/chart-similarity/', views.api_chart_similarity, name='maps.api_chart_similarity'),
+    path('api/chart-history/', views.api_chart_history, name='maps.api_chart_history'),
     path('api/chart-countries/', views.api_chart_countries, name='maps.api_chart_countries'),
 ]
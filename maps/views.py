@@ -1,8 +1,24 @@
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse, HttpResponseBadRequest
-from accounts.spotify import get_user_playlists, get_playlist_tracks, get_top_charts_for_country, get_available_chart_countries
-from typing import Dict, List, Set
+from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest, HttpResponseNotModified, StreamingHttpResponse
+from django.db import connections
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from accounts.admission import heavy
+from accounts.dispatch import Priority, prioritized, priority
+from accounts.cache import CHARTS, GEO, GEO_PARTIAL, PLAYLIST_SETS, USER_PLAYLISTS
+from accounts.spotify import get_user_playlists, get_playlist_tracks, iter_playlist_track_pages, get_playlist, get_top_charts_for_country, get_available_chart_countries, listed_snapshot, spotify_context
+from playlists.analytics import get_snapshot_items
+from playlists.event_stream import ProgressThrottle, event_stream_response, sse_event
+from playlists.models import PlaylistMeta
+from .charts import TrackSets, chart_similarity, chart_version, rank_markets
+from .geo import GeoAccumulator, GeoAggregate, SPOTIFY_MARKETS
+from .history import chart_trend
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import contextvars
+import gzip
+import json
+import requests
 
 
 @login_required
@@ -22,40 +38,29 @@ def api_playlists(request):
         return JsonResponse({"error": "Failed to fetch playlists"}, status=400)
 
     items = data.get('items', [])
+    PlaylistMeta.record(items)
     playlists = [
-        {"id": p.get("id"), "name": p.get("name")}
+        {"id": p.get("id"), "name": p.get("name"), "snapshot_id": p.get("snapshot_id")}
         for p in items if p.get("id") and p.get("name")
     ]
-    return JsonResponse({"playlists": playlists})
-
-
-SPOTIFY_MARKETS: Set[str] = set([
-    # Spotify supported market codes as of 2024/2025 (ISO 3166-1 alpha-2)
-    'AD','AE','AF','AG','AL','AM','AO','AR','AT','AU','AZ','BA','BB','BD','BE','BF','BG','BH','BI','BJ','BN','BO','BR','BS','BT','BW','BY','BZ',
-    'CA','CD','CG','CH','CI','CL','CM','CO','CR','CV','CW','CY','CZ',
-    'DE','DJ','DK','DM','DO','DZ',
-    'EC','EE','EG','ES','ET',
-    'FI','FJ','FM','FR',
-    'GA','GB','GD','GE','GH','GM','GN','GQ','GR','GT','GW','GY',
-    'HK','HN','HR','HT','HU',
-    'ID','IE','IL','IN','IQ','IS','IT',
-    'JM','JO','JP',
-    'KE','KG','KH','KI','KM','KN','KR','KW','KZ',
-    'LA','LB','LC','LI','LK','LR','LS','LT','LU','LV','LY',
-    'MA','MC','MD','ME','MG','MH','MK','ML','MM','MN','MO','MR','MT','MU','MV','MW','MX','MY','MZ',
-    'NA','NE','NG','NI','NL','NO','NP','NR','NZ',
-    'OM',
-    'PA','PE','PG','PH','PK','PL','PS','PT','PW','PY',
-    'QA',
-    'RO','RS','RU','RW',
-    'SA','SB','SC','SE','SG','SI','SK','SL','SM','SN','SO','SR','ST','SV','SZ',
-    'TD','TG','TH','TJ','TL','TN','TO','TR','TT','TV','TW','TZ',
-    'UA','UG','US','UY','UZ',
-    'VC','VE','VN','VU',
-    'WS',
-    'XK',
-    'ZA','ZM','ZW'
-])
+    stale_since = USER_PLAYLISTS.stale_since(user=request.user)
+    return JsonResponse({
+        "playlists": playlists,
+        "stale_since": stale_since.isoformat() if stale_since else None,
+    })
+
+
+def _gzip_json_response(request, body_gz, etag, cache_control):
+    """Serve a gzip-compressed JSON body, inflating it for clients without gzip."""
+    if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        response = HttpResponse(body_gz, content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(gzip.decompress(body_gz), content_type='application/json')
+    response['ETag'] = etag
+    response['Cache-Control'] = cache_control
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
 
 
 @login_required
@@ -64,56 +69,235 @@ def api_playlist_geo(request):
     Compute per-country presence for a given playlist based on track available_markets
     and aggregate top artists per country (from the user's playlist content).
     Returns JSON with ISO2 codes and top artists mapping.
+
+    A playlist's content is fixed per snapshot_id, so the serialized payload is
+    cached gzip-compressed under (playlist_id, snapshot_id) and tagged with an
+    ETag. Repeat views are a 304 or a single cache read.
     """
     playlist_id = request.GET.get('playlist_id')
     if not playlist_id:
         return HttpResponseBadRequest('playlist_id is required')
 
+    # The map passes the snapshot it listed; anything the user's own list
+    # doesn't vouch for is ignored and Spotify is asked instead
+    snapshot_id = request.GET.get('snapshot_id')
+    if snapshot_id and snapshot_id == listed_snapshot(request.user, playlist_id):
+        cache_control = 'private, max-age=86400'
+    else:
+        try:
+            playlist = get_playlist(request.user, playlist_id)
+        except Exception as e:
+            return JsonResponse({"error": "Failed to fetch playlist"}, status=400)
+        PlaylistMeta.record([playlist])
+        snapshot_id = playlist.get('snapshot_id') or ''
+        cache_control = 'private, no-cache'
+
+    etag = f'"geo-{playlist_id}-{snapshot_id}"'
+    if snapshot_id and etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        response['Cache-Control'] = cache_control
+        return response
+
+    body_gz = GEO.get(playlist_id, snapshot_id) if snapshot_id else None
+    if body_gz is None:
+        try:
+            items = get_playlist_tracks(request.user, playlist_id)
+        except Exception as e:
+            return JsonResponse({"error": "Failed to fetch playlist tracks"}, status=400)
+
+        payload = GeoAggregate.from_items(items).to_payload()
+        body_gz = gzip.compress(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+        if snapshot_id:
+            GEO.set(playlist_id, snapshot_id, value=body_gz)
+
+    return _gzip_json_response(request, body_gz, etag, cache_control)
+
+
+def _playlist_geo_events(user, playlist_id, snapshot_id):
+    body_gz = GEO.get(playlist_id, snapshot_id) if snapshot_id else None
+    if body_gz is not None:
+        yield sse_event('done', json.loads(gzip.decompress(body_gz)))
+        return
+
+    merged = GeoAccumulator()
+    throttle = ProgressThrottle()
+    loaded = 0
     try:
-        items = get_playlist_tracks(request.user, playlist_id)
+        for page in iter_playlist_track_pages(user, playlist_id):
+            merged.add(GeoAggregate.from_items(page['items']))
+            loaded += len(page['items'])
+            if page.get('next') and throttle.due():
+                yield sse_event('progress', {
+                    'loaded': loaded,
+                    'total': page.get('total') or loaded,
+                    'geo': merged.aggregate().to_payload(),
+                })
     except Exception as e:
-        return JsonResponse({"error": "Failed to fetch playlist tracks"}, status=400)
-
-    presence: Set[str] = set()
-    top_artists_by_country: Dict[str, Dict[str, int]] = {}
-
-    for item in items:
-        track = (item or {}).get('track') or {}
-        if not track:
-            continue
-        markets: List[str] = track.get('available_markets') or []
-        artists = track.get('artists') or []
-        artist_names = [a.get('name') for a in artists if a.get('name')]
-        if not artist_names:
-            continue
-        for m in markets:
-            if not m:
-                continue
-            presence.add(m)
-            bucket = top_artists_by_country.setdefault(m, {})
-            for name in artist_names:
-                bucket[name] = bucket.get(name, 0) + 1
-
-    presence_iso2 = sorted(presence)
-    absence_iso2 = sorted(list(SPOTIFY_MARKETS - presence))
-
-    # Collapse top artists to top 5 per country
-    top_artists = {
-        iso2: sorted(artists.items(), key=lambda kv: kv[1], reverse=True)[:5]
-        for iso2, artists in top_artists_by_country.items()
-    }
+        yield sse_event('error', {'error': 'Failed to fetch playlist tracks'})
+        return
 
-    # Convert tuples to objects for JSON
-    top_artists = {
-        iso2: [{"name": name, "count": count} for name, count in pairs]
-        for iso2, pairs in top_artists.items()
-    }
+    payload = merged.aggregate().to_payload()
+    if snapshot_id:
+        body_gz = gzip.compress(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+        GEO.set(playlist_id, snapshot_id, value=body_gz)
+    yield sse_event('done', payload)
 
-    return JsonResponse({
-        "presence_iso2": presence_iso2,
-        "absence_iso2": absence_iso2,
-        "top_artists": top_artists,
-    })
+
+@login_required
+def api_playlist_geo_events(request):
+    """
+    api_playlist_geo as server-sent events: "progress" events with the partial
+    geo payload as pages of tracks arrive (at most one per
+    STREAM_PROGRESS_INTERVAL), then "done" with the full payload
+    (or "error"). The result is cached like api_playlist_geo's, when the
+    snapshot matches the user's playlist list.
+    """
+    playlist_id = request.GET.get('playlist_id')
+    if not playlist_id:
+        return HttpResponseBadRequest('playlist_id is required')
+    snapshot_id = request.GET.get('snapshot_id', '')
+    if snapshot_id and snapshot_id != listed_snapshot(request.user, playlist_id):
+        snapshot_id = ''
+    return event_stream_response(request, _playlist_geo_events(request.user, playlist_id, snapshot_id))
+
+
+def _refresh_token_if_expired(user):
+    """Refresh the user's token once before fanning out to worker threads,
+    so the workers don't race each other to refresh it."""
+    spotify_context(user).token()
+
+
+def _run_in_worker(func, *args):
+    """Run ``func`` on a pool thread, then close that thread's DB connections."""
+    try:
+        return func(*args)
+    finally:
+        connections.close_all()
+
+
+def _submit(pool, func, *args):
+    """Submit ``func`` to ``pool`` in the caller's context (Spotify priority class)."""
+    return pool.submit(contextvars.copy_context().run, _run_in_worker, func, *args)
+
+
+def _fetch_geo_partial(user, playlist):
+    """Download one playlist's tracks and cache its geo aggregate."""
+    partial = GeoAggregate.from_items(get_playlist_tracks(user, playlist['id']))
+    if playlist.get('snapshot_id'):
+        GEO_PARTIAL.set(playlist['id'], playlist['snapshot_id'], value=partial)
+    return partial
+
+
+def _library_geo_lines(user, playlists):
+    """Yield NDJSON progress lines carrying the merged geo of finished playlists."""
+    total = len(playlists)
+    merged = GeoAccumulator()
+    done = failed = 0
+
+    # Unchanged playlists come straight from their cached partials
+    cached = GEO_PARTIAL.get_many((p['id'], p['snapshot_id']) for p in playlists if p.get('snapshot_id'))
+    for partial in cached.values():
+        merged.add(partial)
+        done += 1
+
+    pending = [
+        p for p in playlists
+        if not p.get('snapshot_id') or (p['id'], p['snapshot_id']) not in cached
+    ]
+    if pending:
+        if done:
+            yield json.dumps({"done": done, "total": total, "geo": merged.aggregate().to_payload()}) + "\n"
+        throttle = ProgressThrottle()
+        with ThreadPoolExecutor(max_workers=settings.GEO_LIBRARY_WORKERS) as pool:
+            futures = [_submit(pool, _fetch_geo_partial, user, p) for p in pending]
+            try:
+                for future in as_completed(futures):
+                    done += 1
+                    try:
+                        merged.add(future.result())
+                    except Exception:
+                        failed += 1
+                        continue
+                    if done < total and throttle.due():
+                        yield json.dumps({"done": done, "total": total, "geo": merged.aggregate().to_payload()}) + "\n"
+            except GeneratorExit:
+                # Client went away: drop the playlists not started yet, only
+                # wait for the ones already downloading
+                pool.shutdown(cancel_futures=True)
+                raise
+
+    yield json.dumps({
+        "done": done, "total": total, "failed": failed, "complete": True,
+        "geo": merged.aggregate().to_payload(),
+    }) + "\n"
+
+
+@heavy
+@login_required
+def api_library_geo(request):
+    """
+    Geo presence and top artists across all of the user's playlists.
+
+    Playlists are downloaded in parallel and each one's aggregate is cached per
+    snapshot, so unchanged playlists are never refetched. The response is
+    newline-delimited JSON: lines with the merged result so far as playlists
+    finish (at most one per STREAM_PROGRESS_INTERVAL), the last one marked
+    "complete".
+    """
+    try:
+        data = get_user_playlists(request.user)
+        _refresh_token_if_expired(request.user)
+    except Exception as e:
+        return JsonResponse({"error": "Failed to fetch playlists"}, status=400)
+
+    playlists = [p for p in data.get('items', []) if p and p.get('id')]
+    PlaylistMeta.record(playlists)
+
+    response = StreamingHttpResponse(
+        prioritized(_library_geo_lines(request.user, playlists), Priority.BULK),
+        content_type='application/x-ndjson',
+    )
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _country_chart(user, country_code):
+    """Chart data for a country, shared by all users through the cache.
+
+    Failed lookups are not cached so the next request retries them. When
+    Spotify fails, the last good copy is returned with a ``stale_since`` stamp.
+    """
+    country_code = country_code.upper()
+    chart = CHARTS.get(country_code)
+    if chart is not None:
+        return chart
+
+    error = None
+    try:
+        chart = get_top_charts_for_country(user, country_code)
+    except requests.RequestException as e:
+        error = e
+    if error is None and not chart.get('error'):
+        CHARTS.set(country_code, value=chart)
+        return chart
+
+    # Rate limited or unreachable: fall back to the last good copy
+    stale = CHARTS.get(country_code, allow_stale=True)
+    if stale is not None:
+        return {**stale, 'stale_since': CHARTS.stale_since(country_code).isoformat()}
+    if error is not None:
+        raise error
+    return chart
+
+
+def _chart_is_cacheable(chart):
+    """Only fresh, successful charts may be cached by the browser."""
+    return not chart.get('error') and not chart.get('stale_since')
+
+
+def _chart_cache_control():
+    return f"private, max-age={settings.CHART_CACHE_TIMEOUT}"
 
 
 @login_required
@@ -127,8 +311,11 @@ def api_country_charts(request):
         return HttpResponseBadRequest('country parameter is required')
     
     try:
-        chart_data = get_top_charts_for_country(request.user, country_code)
-        return JsonResponse(chart_data)
+        chart_data = _country_chart(request.user, country_code)
+        response = JsonResponse(chart_data)
+        if _chart_is_cacheable(chart_data):
+            response['Cache-Control'] = _chart_cache_control()
+        return response
     except Exception as e:
         import traceback
         error_trace = traceback.format_exc()
@@ -143,6 +330,212 @@ def api_country_charts(request):
         }, status=400)
 
 
+def _cached_charts(codes, allow_stale=False):
+    """The charts of ``codes`` already in the cache, from one bulk read; no Spotify calls.
+
+    With ``allow_stale``, expired copies fill in for missing charts, stamped
+    with ``stale_since`` like _country_chart's fallback.
+    """
+    charts = {code: chart for (code,), chart in CHARTS.get_many((code,) for code in codes).items()}
+    missing = [code for code in codes if code not in charts]
+    if allow_stale and missing:
+        for (code,), chart in CHARTS.get_many(((code,) for code in missing), allow_stale=True).items():
+            stale_since = CHARTS.stale_since(code)
+            charts[code] = {**chart, 'stale_since': stale_since.isoformat()} if stale_since else chart
+    return charts
+
+
+def _resolve_charts(user, codes):
+    """Charts for ``codes`` (upper-case ISO2), keyed in the given order.
+
+    Cached charts come from one bulk cache read; the rest are fetched from
+    Spotify concurrently. Countries that fail carry an ``error`` entry.
+    """
+    charts = _cached_charts(codes)
+    missing = [code for code in codes if code not in charts]
+
+    if missing:
+        _refresh_token_if_expired(user)
+        with ThreadPoolExecutor(max_workers=settings.CHART_BATCH_WORKERS) as pool:
+            futures = {_submit(pool, _country_chart, user, code): code for code in missing}
+            for future in as_completed(futures):
+                code = futures[future]
+                try:
+                    charts[code] = future.result()
+                except Exception as e:
+                    charts[code] = {
+                        "error": str(e),
+                        "country_code": code,
+                        "has_chart": False,
+                        "artists": []
+                    }
+    return {code: charts[code] for code in codes}
+
+
+def _cached_only(request):
+    """The batch endpoint's ?cached=1 prefetch only reads the cache."""
+    return bool(request.GET.get('cached'))
+
+
+@heavy(unless=_cached_only)
+@login_required
+def api_country_charts_batch(request):
+    """
+    Charts for many countries in one response: ?countries=US,GB,FR.
+
+    Cached countries are answered from the shared cache, the rest are fetched
+    from Spotify concurrently. Returns {"charts": {ISO2: chart}}. With
+    ?cached=1 only the cached countries are returned and Spotify is not called.
+    """
+    codes = sorted({c.strip().upper() for c in request.GET.get('countries', '').split(',') if c.strip()})
+    if not codes:
+        return HttpResponseBadRequest('countries parameter is required')
+    if len(codes) > settings.CHART_BATCH_MAX_COUNTRIES:
+        return HttpResponseBadRequest(f'at most {settings.CHART_BATCH_MAX_COUNTRIES} countries per request')
+
+    if request.GET.get('cached'):
+        # The map's prefetch: whatever is cached now, the rest load on click
+        return JsonResponse({"charts": _cached_charts(codes)})
+
+    try:
+        # The map prefetches every chart country through here
+        with priority(Priority.BACKGROUND):
+            charts = _resolve_charts(request.user, codes)
+    except Exception as e:
+        return JsonResponse({"error": "Failed to refresh Spotify token"}, status=400)
+
+    response = JsonResponse({"charts": charts})
+    if all(_chart_is_cacheable(chart) for chart in charts.values()):
+        response['Cache-Control'] = _chart_cache_control()
+    return response
+
+
+def _playlist_track_sets(user, playlist_id, snapshot_id):
+    """TrackSets for a playlist, cached per snapshot like its geo payload.
+
+    ``snapshot_id`` must come from the user's playlist list or from Spotify,
+    never straight from the client.
+    """
+    sets = PLAYLIST_SETS.get(playlist_id, snapshot_id) if snapshot_id else None
+    if sets is None:
+        items = get_snapshot_items(user, {'id': playlist_id, 'snapshot_id': snapshot_id})
+        sets = TrackSets.from_items(items)
+        if snapshot_id:
+            PLAYLIST_SETS.set(playlist_id, snapshot_id, value=sets)
+    return sets
+
+
+@heavy
+@login_required
+def api_chart_overlap(request):
+    """
+    Overlap between a playlist and the chart of every chart country.
+
+    ?playlist_id=...&snapshot_id=... (snapshot optional, and only used when it
+    matches the user's playlist list) returns, per country, shared artists,
+    shared track count and artist/track Jaccard scores, ranked as
+    {"markets": [...]} with the most similar market first. Pass ?country=XX to
+    get a single country's overlap instead.
+    """
+    playlist_id = request.GET.get('playlist_id')
+    if not playlist_id:
+        return HttpResponseBadRequest('playlist_id is required')
+
+    # Playlist sets are cached across users: only trust a snapshot the user lists
+    snapshot_id = request.GET.get('snapshot_id')
+    if not snapshot_id or snapshot_id != listed_snapshot(request.user, playlist_id):
+        try:
+            playlist = get_playlist(request.user, playlist_id)
+        except Exception as e:
+            return JsonResponse({"error": "Failed to fetch playlist"}, status=400)
+        PlaylistMeta.record([playlist])
+        snapshot_id = playlist.get('snapshot_id') or ''
+
+    country = request.GET.get('country', '').strip().upper()
+    codes = [country] if country else [c for c in get_available_chart_countries() if c != 'GLOBAL']
+
+    try:
+        sets = _playlist_track_sets(request.user, playlist_id, snapshot_id)
+        # Sweeping every chart country must not crowd out interactive calls
+        with priority(Priority.INTERACTIVE if country else Priority.BACKGROUND):
+            charts = _resolve_charts(request.user, codes)
+    except Exception as e:
+        return JsonResponse({"error": "Failed to fetch playlist tracks or charts"}, status=400)
+
+    markets = rank_markets(sets, charts)
+    if country:
+        if not markets:
+            return JsonResponse({"error": "Could not fetch charts", "country_code": country}, status=400)
+        return JsonResponse(markets[0])
+    return JsonResponse({
+        "playlist_id": playlist_id,
+        "snapshot_id": snapshot_id,
+        "markets": markets,
+    })
+
+
+@login_required
+def api_chart_similarity(request):
+    """
+    Country x country similarity of the chart countries' Top 50s.
+
+    Returns {"version", "countries", "artist_jaccard", "track_jaccard",
+    "missing", "stale"} with row/column order given by "countries". ?format=bin
+    returns both matrices as uint8 (0-255 for 0.0-1.0), artists then tracks,
+    row-major, with the country order in the X-Chart-Countries header.
+
+    Only charts already in the cache are used; capture_charts fills them and
+    builds the matrix, keyed by the charts' content version. Countries without
+    a cached chart are listed in "missing" and expired charts are used as they
+    are ("stale"); such partial results are not cached by the browser.
+    """
+    codes = [c for c in get_available_chart_countries() if c != 'GLOBAL']
+    charts = {
+        code: chart for code, chart in _cached_charts(codes, allow_stale=True).items()
+        if not chart.get('error')
+    }
+    missing = [code for code in codes if code not in charts]
+    stale = any(chart.get('stale_since') for chart in charts.values())
+
+    version = chart_version(charts)
+    etag = f'"chart-similarity-{version}"'
+    if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    matrix = chart_similarity(charts)
+
+    if request.GET.get('format') == 'bin':
+        response = HttpResponse(matrix.to_bytes(), content_type='application/octet-stream')
+        response['X-Chart-Countries'] = ','.join(matrix.countries)
+        response['X-Chart-Missing'] = ','.join(missing)
+    else:
+        response = JsonResponse({**matrix.to_payload(), "missing": missing, "stale": stale})
+    response['ETag'] = etag
+    if missing or stale:
+        response['Cache-Control'] = 'private, no-cache'
+    else:
+        response['Cache-Control'] = _chart_cache_control()
+    return response
+
+
+@login_required
+def api_chart_history(request):
+    """
+    Chart history of an artist or track in one country, from local captures.
+
+    ?country=BR&artist=Anitta or ?country=BR&track_id=... returns days charted,
+    first/last seen, best rank, current streak and the per-day rank series.
+    """
+    country = request.GET.get('country', '').strip().upper()
+    artist = request.GET.get('artist', '').strip()
+    track_id = request.GET.get('track_id', '').strip()
+    if not country or not (artist or track_id):
+        return HttpResponseBadRequest('country and one of artist or track_id are required')
+    return JsonResponse(chart_trend(country, artist=artist, track_id=track_id))
+
+
 @login_required
 def api_chart_countries(request):
     """Return list of countries that have Spotify Top 50 charts available."""
@@ -1,29 +1,87 @@
 from django.contrib import admin
-from django.http import HttpResponse
-import csv
-from .models import KeptSong
-from accounts.spotify import get_playlist
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.utils.decorators import method_decorator
+from accounts.replica import on_replica, replica_configured, reporting
+from .models import KeptSong, KeptSongArtist, PlaylistMeta, Artist
+from .csv_stream import streaming_csv_response
+from .normalize import artist_key, format_artists
+
+# Rows fetched per database round trip when streaming the admin export
+EXPORT_CHUNK_SIZE = 2000
+
+# Most frequent artists offered by the changelist's artist filter
+ARTIST_FILTER_CHOICES = 30
+
+
+def _artist_decisions(artist_ids):
+    """Subquery of KeptSong ids linked to any of ``artist_ids``."""
+    return KeptSongArtist.objects.filter(artist__in=artist_ids).values('kept_song_id')
+
+
+class ArtistListFilter(admin.SimpleListFilter):
+    """Filter decisions by one of the most frequent artists."""
+    title = 'artist'
+    parameter_name = 'artist'
+    
+    def lookups(self, request, model_admin):
+        artists = (
+            Artist.objects.annotate(decision_count=Count('song_links'))
+            .order_by('-decision_count', 'name')[:ARTIST_FILTER_CHOICES]
+        )
+        return [(artist.pk, artist.name) for artist in artists]
+    
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(pk__in=_artist_decisions([self.value()]))
+        return queryset
 
 
 @admin.register(KeptSong)
 class KeptSongAdmin(admin.ModelAdmin):
     list_display = ('user', 'get_playlist_name', 'name', 'get_artists', 'kept', 'created_at')
-    list_filter = ('kept', 'created_at', 'user')
-    search_fields = ('user__username', 'playlist_id', 'name', 'artists')
+    list_filter = ('kept', 'created_at', 'user', ArtistListFilter)
+    # Artists are matched separately in get_search_results
+    search_fields = ('user__username', 'playlist_id', 'name')
     list_per_page = 25
     ordering = ('-created_at',)
     actions = ['export_as_csv']
     
+    def get_queryset(self, request):
+        """Resolve playlist names from PlaylistMeta in the changelist query itself"""
+        qs = super().get_queryset(request)
+        return qs.annotate(
+            playlist_name=Subquery(
+                PlaylistMeta.objects.filter(playlist_id=OuterRef('playlist_id')).values('name')[:1]
+            )
+        )
+    
+    def get_search_results(self, request, queryset, search_term):
+        """Also match decisions whose artist name starts with the search term.
+
+        The term is normalized with artist_key and looked up as a range on
+        Artist.normalized_name, so it uses that column's unique index and
+        "The  Beatles" finds "the beatles".
+        """
+        unsearched = queryset
+        queryset, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        key = artist_key(search_term)
+        if key:
+            artist_ids = Artist.objects.filter(
+                normalized_name__gte=key, normalized_name__lt=key + '\U0010ffff',
+            ).values('pk')
+            queryset |= unsearched.filter(pk__in=_artist_decisions(artist_ids))
+        return queryset, may_have_duplicates
+    
     def get_playlist_name(self, obj):
-        """Fetch and display the playlist name from Spotify"""
-        try:
-            playlist_data = get_playlist(obj.user, obj.playlist_id)
-            return playlist_data.get('name', obj.playlist_id)
-        except Exception as e:
-            # If we can't fetch the playlist name, fall back to the ID
-            return f"{obj.playlist_id[:20]}..."
+        """Display the locally cached playlist name"""
+        name = getattr(obj, 'playlist_name', None)
+        if name:
+            return name
+        # Playlist not seen yet by any view, fall back to the ID
+        return f"{obj.playlist_id[:20]}..."
     
     get_playlist_name.short_description = 'Playlist'
+    get_playlist_name.admin_order_field = 'playlist_name'
     
     def get_artists(self, obj):
         """Display artists in a readable format"""
@@ -64,29 +122,37 @@ class KeptSongAdmin(admin.ModelAdmin):
             
     get_artists.short_description = 'Artists'
     
-    def export_as_csv(self, request, queryset):
-        """Export selected songs as CSV"""
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename=songs_export.csv'
-        writer = csv.writer(response)
-        
-        # Write header with only the requested fields
-        writer.writerow(['User', 'Song Name', 'Artists', 'Kept', 'Spotify URL'])
+    def _export_rows(self, queryset):
+        """Yield CSV rows for the export, reading the queryset in chunks"""
+        # Header with only the requested fields
+        yield ['User', 'Song Name', 'Artists', 'Kept', 'Spotify URL']
         
-        # Write data rows
-        for obj in queryset:
-            artists_str = self.get_artists(obj)
-            
-            row = [
-                obj.user.username,
-                obj.name,
-                artists_str,
-                'Yes' if obj.kept else 'No',
-                obj.spotify_url or ''
+        # values_list joins the user in the same query and skips model
+        # instances; format_artists copes with rows not yet normalized
+        rows = (
+            queryset.values_list('user__username', 'name', 'artists', 'kept', 'spotify_url')
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        )
+        for username, name, artists, kept, spotify_url in rows:
+            yield [
+                username,
+                name,
+                format_artists(artists),
+                'Yes' if kept else 'No',
+                spotify_url or ''
             ]
-            writer.writerow(row)
-        
-        return response
+    
+    @method_decorator(reporting)
+    def changelist_view(self, request, extra_context=None):
+        """Serve the listing from the read replica when one is configured"""
+        return super().changelist_view(request, extra_context)
+    
+    def export_as_csv(self, request, queryset):
+        """Export selected songs as a streamed CSV"""
+        rows = self._export_rows(queryset)
+        if replica_configured():
+            rows = on_replica(rows)
+        return streaming_csv_response(rows, 'songs_export.csv')
     
     export_as_csv.short_description = "Export selected songs as CSV"
     
@@ -109,4 +175,48 @@ class KeptSongAdmin(admin.ModelAdmin):
     readonly_fields = ('created_at',)
 
 
+@admin.register(PlaylistMeta)
+class PlaylistMetaAdmin(admin.ModelAdmin):
+    list_display = ('name', 'owner', 'playlist_id', 'snapshot_id', 'fetched_at')
+    search_fields = ('name', 'owner', 'playlist_id')
+    ordering = ('-fetched_at',)
+    list_per_page = 25
+
+
+@admin.register(Artist)
+class ArtistAdmin(admin.ModelAdmin):
+    list_display = ('name', 'decision_count', 'kept_count', 'removed_count')
+    search_fields = ('^normalized_name',)
+    list_per_page = 25
+    ordering = ('normalized_name',)
+    readonly_fields = ('normalized_name',)
+    
+    def get_queryset(self, request):
+        """Annotate per-artist decision counts from the through table"""
+        qs = super().get_queryset(request)
+        return qs.annotate(
+            _decision_count=Count('song_links'),
+            _kept_count=Count('song_links', filter=Q(song_links__kept_song__kept=True)),
+            _removed_count=Count('song_links', filter=Q(song_links__kept_song__kept=False)),
+        )
+    
+    def decision_count(self, obj):
+        return obj._decision_count
+    
+    decision_count.short_description = 'Decisions'
+    decision_count.admin_order_field = '_decision_count'
+    
+    def kept_count(self, obj):
+        return obj._kept_count
+    
+    kept_count.short_description = 'Kept'
+    kept_count.admin_order_field = '_kept_count'
+    
+    def removed_count(self, obj):
+        return obj._removed_count
+    
+    removed_count.short_description = 'Removed'
+    removed_count.admin_order_field = '_removed_count'
+
+
 # Register your models here.
@@ -0,0 +1,184 @@
+"""Columnar analytics over a user's Spotify library.
+
+Tracks are folded into flat NumPy columns (duration, popularity, release year)
+and artists are integer-coded, so totals, top-k artists, decade histograms and
+popularity rankings are vectorized operations instead of Counter passes over
+Python lists.
+"""
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from accounts.cache import PLAYLIST_TRACKS
+from accounts.spotify import get_playlist_tracks
+
+
+def _release_year(track: dict) -> int:
+    """Return the album release year of a track, or 0 when unknown."""
+    release_date = (track.get('album') or {}).get('release_date') or ''
+    try:
+        return int(release_date.split('-')[0])
+    except (ValueError, IndexError):
+        return 0
+
+
+class LibraryColumns:
+    """Immutable columnar view of a library: one row per track appearance.
+
+    ``artist_codes`` holds one entry per (track, artist) appearance and indexes
+    into ``artist_names``; ``artist_offsets[i]:artist_offsets[i + 1]`` is the
+    slice of appearances belonging to track ``i``.
+    """
+
+    def __init__(self, duration_ms, popularity, release_year, artist_codes,
+                 artist_offsets, artist_names, track_names):
+        self.duration_ms = duration_ms
+        self.popularity = popularity
+        self.release_year = release_year
+        self.artist_codes = artist_codes
+        self.artist_offsets = artist_offsets
+        self.artist_names = artist_names
+        self.track_names = track_names
+
+    @property
+    def track_count(self) -> int:
+        return int(self.duration_ms.shape[0])
+
+    @property
+    def unique_artists(self) -> int:
+        return len(self.artist_names)
+
+    def total_duration_ms(self) -> int:
+        return int(self.duration_ms.sum())
+
+    def artist_counts(self) -> np.ndarray:
+        """Number of appearances per artist code."""
+        return np.bincount(self.artist_codes, minlength=len(self.artist_names))
+
+    def top_artists(self, k: Optional[int] = None) -> List[Tuple[str, int]]:
+        """Return the ``k`` most frequent artists as (name, count) pairs.
+
+        Ties keep first-seen order, matching ``Counter.most_common``.
+        """
+        counts = self.artist_counts()
+        if counts.size == 0:
+            return []
+        if k is None or k >= counts.size:
+            candidates = np.arange(counts.size)
+        else:
+            # Only artists at or above the k-th largest count can make the cut
+            threshold = np.partition(counts, counts.size - k)[counts.size - k]
+            candidates = np.flatnonzero(counts >= threshold)
+        order = candidates[np.argsort(-counts[candidates], kind='stable')][:k]
+        return [(self.artist_names[i], int(counts[i])) for i in order]
+
+    def decade_histogram(self) -> List[Tuple[int, int]]:
+        """Return (decade, track count) pairs, newest decade first."""
+        years = self.release_year[self.release_year > 0]
+        decades, counts = np.unique((years // 10) * 10, return_counts=True)
+        return [(int(d), int(c)) for d, c in zip(decades[::-1], counts[::-1])]
+
+    def popularity_ranking(self) -> np.ndarray:
+        """Track indices ordered by popularity, most popular first (stable)."""
+        return np.argsort(-self.popularity, kind='stable')
+
+    def track_artists(self, index: int) -> List[str]:
+        start, end = self.artist_offsets[index], self.artist_offsets[index + 1]
+        return [self.artist_names[c] for c in self.artist_codes[start:end]]
+
+
+class LibraryBuilder:
+    """Accumulates raw playlist track items into a :class:`LibraryColumns`.
+
+    Items can be added playlist by playlist; only compact columns are kept, so
+    the raw Spotify payloads can be discarded as soon as they are folded in.
+    """
+
+    def __init__(self, keep_track_names: bool = False):
+        self._duration = array('q')
+        self._popularity = array('h')
+        self._year = array('h')
+        self._artist_codes = array('i')
+        self._artist_offsets = array('q', [0])
+        self._artist_index: Dict[str, int] = {}
+        self._artist_names: List[str] = []
+        self._keep_track_names = keep_track_names
+        self._track_names: List[str] = []
+
+    def add_items(self, items: Iterable[dict]) -> None:
+        """Fold playlist track items (as returned by Spotify) into the columns."""
+        for item in items:
+            track = (item or {}).get('track')
+            if not track:
+                continue
+            self._duration.append(track.get('duration_ms') or 0)
+            self._popularity.append(track.get('popularity') or 0)
+            self._year.append(_release_year(track))
+            for artist in track.get('artists') or []:
+                name = artist.get('name', 'Unknown')
+                code = self._artist_index.get(name)
+                if code is None:
+                    code = self._artist_index[name] = len(self._artist_names)
+                    self._artist_names.append(name)
+                self._artist_codes.append(code)
+            self._artist_offsets.append(len(self._artist_codes))
+            if self._keep_track_names:
+                self._track_names.append(track.get('name', 'Unknown'))
+
+    def build(self) -> LibraryColumns:
+        return LibraryColumns(
+            duration_ms=np.frombuffer(self._duration, dtype=np.int64).copy(),
+            popularity=np.frombuffer(self._popularity, dtype=np.int16).copy(),
+            release_year=np.frombuffer(self._year, dtype=np.int16).copy(),
+            artist_codes=np.frombuffer(self._artist_codes, dtype=np.int32).copy(),
+            artist_offsets=np.frombuffer(self._artist_offsets, dtype=np.int64).copy(),
+            artist_names=self._artist_names,
+            track_names=self._track_names,
+        )
+
+
+def _slim_item(item: dict) -> dict:
+    """Strip a playlist item down to the fields analytics and chart overlap read."""
+    track = item['track']
+    return {'track': {
+        'id': track.get('id'),
+        'name': track.get('name'),
+        'duration_ms': track.get('duration_ms'),
+        'popularity': track.get('popularity'),
+        'album': {'release_date': (track.get('album') or {}).get('release_date')},
+        'artists': [{'name': a.get('name', 'Unknown')} for a in track.get('artists') or []],
+    }}
+
+
+def get_snapshot_items(user, playlist: dict) -> List[dict]:
+    """Return a playlist's track items, served from the snapshot cache if possible.
+
+    A playlist's contents are fixed for a given ``snapshot_id``, so slimmed items
+    are cached under (playlist id, snapshot id) and reused by every analytics
+    scan until the playlist changes. That cache is shared across users, so
+    ``playlist`` must be an entry of the user's own playlist list (or fetched
+    from Spotify for them), not ids taken from the client.
+    """
+    snapshot_id = playlist.get('snapshot_id')
+    if not snapshot_id:
+        return get_playlist_tracks(user, playlist['id'])
+    return PLAYLIST_TRACKS.get_or_set(
+        playlist['id'], snapshot_id,
+        compute=lambda: [_slim_item(i) for i in get_playlist_tracks(user, playlist['id'])
+                         if (i or {}).get('track')],
+    )
+
+
+def load_library(user, playlists, keep_track_names: bool = False) -> LibraryColumns:
+    """Fetch every track of ``playlists`` and return them as columns.
+
+    Playlists that fail to load are skipped, as the analytics views always did.
+    """
+    builder = LibraryBuilder(keep_track_names=keep_track_names)
+    for playlist in playlists:
+        try:
+            builder.add_items(get_snapshot_items(user, playlist))
+        except Exception:
+            continue
+    return builder.build()
@@ -0,0 +1,23 @@
+"""Helpers for serving CSV files as streamed downloads."""
+import csv
+
+from django.http import StreamingHttpResponse
+
+
+class Echo:
+    """File-like object whose write() hands the value back, so csv.writer
+    output can be yielded straight into a StreamingHttpResponse."""
+
+    def write(self, value):
+        return value
+
+
+def streaming_csv_response(rows, filename):
+    """Stream ``rows`` (an iterable of lists) as a CSV attachment."""
+    writer = csv.writer(Echo())
+    response = StreamingHttpResponse(
+        (writer.writerow(row) for row in rows),
+        content_type='text/csv',
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,82 @@
+"""Server-sent event (text/event-stream) responses.
+
+Views describe a stream as an ordinary generator of :func:`sse_event` strings
+doing blocking work (Spotify calls, DB reads) between yields. Under ASGI the
+generator is advanced one event at a time on a worker thread and the response
+body is an async iterator, so a viewer waiting between events holds no request
+thread. Under WSGI the generator is streamed directly, and holds a worker for as long
+as the viewer stays connected; serve the app with an ASGI server (see
+CleanBeats/asgi.py) to get the former.
+"""
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.conf import settings
+from django.db import connections
+from django.http import StreamingHttpResponse
+
+_END = object()
+
+
+def sse_event(event: str, data) -> str:
+    """Format one event with a JSON ``data`` line."""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class ProgressThrottle:
+    """Paces partial results to one per STREAM_PROGRESS_INTERVAL seconds.
+
+    Building a partial result (a geo payload, library stats) usually costs far
+    more than the work done between two of them, so streams only build one
+    when ``due()``.
+    """
+
+    def __init__(self):
+        self._last = time.monotonic()
+
+    def due(self) -> bool:
+        now = time.monotonic()
+        if now - self._last < settings.STREAM_PROGRESS_INTERVAL:
+            return False
+        self._last = now
+        return True
+
+
+def _next_event(events):
+    # Each step may land on a different pool thread; don't leave its DB
+    # connection open behind it
+    try:
+        return next(events, _END)
+    finally:
+        connections.close_all()
+
+
+def _close_events(events):
+    try:
+        events.close()
+    finally:
+        connections.close_all()
+
+
+async def _async_events(events):
+    step = sync_to_async(_next_event, thread_sensitive=False)
+    try:
+        while True:
+            chunk = await step(events)
+            if chunk is _END:
+                break
+            yield chunk
+    finally:
+        await sync_to_async(_close_events, thread_sensitive=False)(events)
+
+
+def event_stream_response(request, events) -> StreamingHttpResponse:
+    """Stream ``events`` (a generator of sse_event strings) to the client."""
+    body = _async_events(events) if isinstance(request, ASGIRequest) else events
+    response = StreamingHttpResponse(body, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop reverse proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,127 @@
+import multiprocessing
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+from django.db.utils import OperationalError
+
+PROFILES = ('stock', 'production')
+
+
+def _write_decisions(db_path, profile, user_id, writes, barrier, results):
+    """Worker process: record ``writes`` decisions, one per simulated request."""
+    os.environ['SQLITE_PRODUCTION'] = '1' if profile == 'production' else '0'
+    import django
+    django.setup()
+    from django.conf import settings
+    settings.DATABASES['default']['NAME'] = db_path
+
+    from playlists.models import KeptSong
+    user = get_user_model().objects.get(pk=user_id)
+    close_old_connections()
+
+    latencies, failed = [], 0
+    barrier.wait()
+    started = time.perf_counter()
+    for i in range(writes):
+        # Revisit tracks so the run mixes inserts and updates, as swiping back does
+        track = i % 50
+        t0 = time.perf_counter()
+        try:
+            KeptSong.record_decision(
+                user, 'bench-playlist', f'spotify:track:bench{track}',
+                name=f'Bench track {track}',
+                artists=[f'Bench artist {track % 7}', f'Bench artist {track % 11}'],
+                image_url=None, preview_url=None, spotify_url=None,
+                kept=bool(i % 2),
+            )
+            latencies.append(time.perf_counter() - t0)
+        except OperationalError:
+            failed += 1
+        # End of the request: stock settings reconnect every time
+        close_old_connections()
+    results.put((started, time.perf_counter(), latencies, failed))
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = ("Benchmark concurrent save_decision writes against a scratch copy of the "
+            "schema, with stock SQLite settings and with the production profile.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Concurrent writer processes, like app server workers.')
+        parser.add_argument('--writes', type=int, default=200,
+                            help='Decisions written by each worker.')
+        parser.add_argument('--profiles', default=','.join(PROFILES),
+                            help='Comma-separated profiles to run: stock, production.')
+
+    def handle(self, *args, workers, writes, profiles, **options):
+        if connections['default'].vendor != 'sqlite':
+            raise CommandError("bench_decision_writes only supports SQLite")
+        profiles = [p.strip() for p in profiles.split(',') if p.strip()]
+        unknown = set(profiles) - set(PROFILES)
+        if unknown:
+            raise CommandError(f"Unknown profiles: {', '.join(sorted(unknown))}")
+
+        with tempfile.TemporaryDirectory() as scratch:
+            template = os.path.join(scratch, 'template.sqlite3')
+            user_ids = self._build_template(template, workers)
+
+            self.stdout.write(f"{workers} workers x {writes} decisions")
+            self.stdout.write(f"{'profile':<12}{'writes/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'failed':>8}")
+            for profile in profiles:
+                db_path = os.path.join(scratch, f'{profile}.sqlite3')
+                shutil.copyfile(template, db_path)
+                rate, p50, p95, failed = self._run(db_path, profile, user_ids, writes)
+                self.stdout.write(f"{profile:<12}{rate:>10.0f}{p50:>10.1f}{p95:>10.1f}{failed:>8}")
+
+    def _build_template(self, path, workers):
+        """Migrate an empty database at ``path`` and create one user per worker."""
+        connection = connections['default']
+        original = connection.settings_dict['NAME']
+        connection.close()
+        connection.settings_dict['NAME'] = path
+        try:
+            call_command('migrate', verbosity=0, interactive=False)
+            User = get_user_model()
+            user_ids = [
+                User.objects.create(username=f'bench-writer-{i}').pk
+                for i in range(workers)
+            ]
+            # Leave the journal mode to each profile
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode=DELETE')
+        finally:
+            connection.close()
+            connection.settings_dict['NAME'] = original
+        return user_ids
+
+    def _run(self, db_path, profile, user_ids, writes):
+        ctx = multiprocessing.get_context('spawn')
+        barrier = ctx.Barrier(len(user_ids))
+        results = ctx.Queue()
+        procs = [
+            ctx.Process(target=_write_decisions, args=(db_path, profile, user_id, writes, barrier, results))
+            for user_id in user_ids
+        ]
+        for proc in procs:
+            proc.start()
+        outcomes = [results.get() for _ in procs]
+        for proc in procs:
+            proc.join()
+
+        elapsed = max(o[1] for o in outcomes) - min(o[0] for o in outcomes)
+        latencies = sorted(l for o in outcomes for l in o[2])
+        failed = sum(o[3] for o in outcomes)
+        if not latencies:
+            return 0.0, 0.0, 0.0, failed
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        return len(latencies) / elapsed, statistics.median(latencies) * 1000, p95 * 1000, failed
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from playlists.models import KeptSong
+from playlists.normalize import decode_unicode_escapes, normalize_artists
+
+
+class Command(BaseCommand):
+    help = ("Rewrite stored KeptSong names and artists into their normalized form "
+            "and rebuild the artist index.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows read and bulk-updated per batch.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Count rows that would change without writing.')
+
+    def handle(self, *args, batch_size, dry_run, **options):
+        scanned = changed = 0
+        last_pk = 0
+        while True:
+            # Keyset pagination keeps each read bounded and never holds a cursor
+            # open across the writes
+            batch = list(
+                KeptSong.objects.filter(pk__gt=last_pk)
+                .order_by('pk')
+                .only('pk', 'name', 'artists')[:batch_size]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            scanned += len(batch)
+
+            dirty = []
+            for song in batch:
+                name = decode_unicode_escapes(song.name or '')
+                artists = normalize_artists(song.artists)
+                if name != song.name or artists != song.artists:
+                    song.name = name
+                    song.artists = artists
+                    dirty.append(song)
+
+            if not dry_run:
+                with transaction.atomic():
+                    if dirty:
+                        KeptSong.objects.bulk_update(dirty, ['name', 'artists'])
+                    KeptSong.sync_artist_index(batch)
+            changed += len(dirty)
+
+        verb = 'Would normalize' if dry_run else 'Normalized'
+        self.stdout.write(self.style.SUCCESS(f"{verb} {changed} of {scanned} decisions."))
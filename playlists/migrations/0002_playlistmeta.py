@@ -0,0 +1,32 @@
+# Generated by Django 5.0 on 2026-10-19 15:38
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlists', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaylistMeta',
+            fields=[
+                ('playlist_id', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('name', models.CharField(blank=True, max_length=512)),
+                ('owner', models.CharField(blank=True, max_length=255)),
+                ('snapshot_id', models.CharField(blank=True, max_length=255)),
+                ('fetched_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Playlist metadata',
+                'verbose_name_plural': 'Playlist metadata',
+            },
+        ),
+        migrations.AlterModelOptions(
+            name='keptsong',
+            options={'verbose_name_plural': 'Songs'},
+        ),
+    ]
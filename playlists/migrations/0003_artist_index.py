@@ -0,0 +1,40 @@
+# Generated by Django 5.0 on 2026-10-19 15:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlists', '0002_playlistmeta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Artist',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=512)),
+                ('normalized_name', models.CharField(max_length=512, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='KeptSongArtist',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField(default=0)),
+                ('artist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='song_links', to='playlists.artist')),
+                ('kept_song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='artist_links', to='playlists.keptsong')),
+            ],
+            options={
+                'ordering': ('position',),
+                'unique_together': {('kept_song', 'artist')},
+            },
+        ),
+        migrations.AddField(
+            model_name='keptsong',
+            name='indexed_artists',
+            field=models.ManyToManyField(blank=True, related_name='decisions', through='playlists.KeptSongArtist', to='playlists.artist'),
+        ),
+    ]
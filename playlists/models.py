@@ -1,8 +1,10 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.utils import timezone
 from django.db.models import JSONField
 
+from .normalize import artist_key
+
 
 class KeptSong(models.Model):
 	"""Stores user's decision for a track in a specific Spotify playlist.
@@ -19,6 +21,8 @@ class KeptSong(models.Model):
 	spotify_url = models.URLField(blank=True, null=True)
 	kept = models.BooleanField()  # True = kept, False = removed
 	created_at = models.DateTimeField(default=timezone.now)
+	# Relational copy of `artists`, maintained on write for indexed artist lookups
+	indexed_artists = models.ManyToManyField('Artist', through='KeptSongArtist', related_name='decisions', blank=True)
 
 	class Meta:
 		unique_together = ("user", "playlist_id", "track_uri")
@@ -26,3 +30,133 @@ class KeptSong(models.Model):
 
 	def __str__(self):
 		return f"{self.user} - {self.playlist_id} - {self.name} ({'kept' if self.kept else 'removed'})"
+
+	@classmethod
+	def record_decision(cls, user, playlist_id, track_uri, **fields):
+		"""Upsert one decision together with its artist index rows.
+
+		Returns (song, created) like update_or_create. ``fields`` must already
+		be normalized (see playlists.normalize).
+		"""
+		with transaction.atomic():
+			song, created = cls.objects.update_or_create(
+				user=user, playlist_id=playlist_id, track_uri=track_uri, defaults=fields,
+			)
+			cls.sync_artist_index([song])
+		return song, created
+
+	@classmethod
+	def sync_artist_index(cls, songs):
+		"""Rebuild the Artist links of `songs` from their normalized `artists` lists.
+
+		Works on whole batches with a fixed number of queries, so it serves both
+		save_decision and the bulk backfill.
+		"""
+		songs = [s for s in songs if s.pk]
+		if not songs:
+			return
+		names = {}
+		for song in songs:
+			for name in song.artists or []:
+				names.setdefault(artist_key(name), name)
+
+		Artist.objects.bulk_create(
+			[Artist(name=name, normalized_name=key) for key, name in names.items()],
+			ignore_conflicts=True,
+		)
+		artist_ids = dict(
+			Artist.objects.filter(normalized_name__in=names).values_list('normalized_name', 'id')
+		)
+
+		links = []
+		for song in songs:
+			seen = set()
+			for position, name in enumerate(song.artists or []):
+				artist_id = artist_ids[artist_key(name)]
+				if artist_id in seen:
+					continue
+				seen.add(artist_id)
+				links.append(KeptSongArtist(kept_song=song, artist_id=artist_id, position=position))
+
+		KeptSongArtist.objects.filter(kept_song__in=songs).delete()
+		KeptSongArtist.objects.bulk_create(links)
+
+
+class Artist(models.Model):
+	"""An artist appearing in decisions, indexed by normalized name."""
+	name = models.CharField(max_length=512)
+	normalized_name = models.CharField(max_length=512, unique=True)
+
+	def __str__(self):
+		return self.name
+
+
+class KeptSongArtist(models.Model):
+	"""Through table linking a decision to each of its artists."""
+	kept_song = models.ForeignKey(KeptSong, on_delete=models.CASCADE, related_name='artist_links')
+	artist = models.ForeignKey(Artist, on_delete=models.CASCADE, related_name='song_links')
+	position = models.PositiveSmallIntegerField(default=0)
+
+	class Meta:
+		unique_together = ("kept_song", "artist")
+		ordering = ("position",)
+
+
+class PlaylistMeta(models.Model):
+	"""Last-seen Spotify metadata for a playlist.
+
+	Filled in whenever a view fetches playlists, so places like the admin can
+	show playlist names without calling Spotify.
+	"""
+	playlist_id = models.CharField(max_length=255, primary_key=True)
+	name = models.CharField(max_length=512, blank=True)
+	owner = models.CharField(max_length=255, blank=True)
+	snapshot_id = models.CharField(max_length=255, blank=True)
+	fetched_at = models.DateTimeField(default=timezone.now)
+
+	class Meta:
+		verbose_name = "Playlist metadata"
+		verbose_name_plural = "Playlist metadata"
+
+	def __str__(self):
+		return self.name or self.playlist_id
+
+	@classmethod
+	def record(cls, playlists):
+		"""Store metadata for Spotify playlist objects that is new or has changed.
+
+		Views call this on every page load, so unchanged playlists cost one
+		read and no write: an upsert would take the database write lock on
+		each GET and compete with save_decision. ``fetched_at`` is therefore
+		when the stored metadata last changed.
+		"""
+		latest = {}
+		for p in playlists:
+			if p and p.get('id'):
+				owner = p.get('owner') or {}
+				latest[p['id']] = (
+					p.get('name') or '',
+					owner.get('display_name') or owner.get('id') or '',
+					p.get('snapshot_id') or '',
+				)
+		if not latest:
+			return
+
+		stored = {
+			playlist_id: fields
+			for playlist_id, *fields in cls.objects.filter(playlist_id__in=latest)
+			.values_list('playlist_id', 'name', 'owner', 'snapshot_id')
+		}
+		now = timezone.now()
+		rows = [
+			cls(playlist_id=playlist_id, name=name, owner=owner, snapshot_id=snapshot_id, fetched_at=now)
+			for playlist_id, (name, owner, snapshot_id) in latest.items()
+			if tuple(stored.get(playlist_id, ())) != (name, owner, snapshot_id)
+		]
+		if rows:
+			cls.objects.bulk_create(
+				rows,
+				update_conflicts=True,
+				unique_fields=['playlist_id'],
+				update_fields=['name', 'owner', 'snapshot_id', 'fetched_at'],
+			)
@@ -0,0 +1,73 @@
+"""Normalization applied to decision metadata before it is stored.
+
+Track names and artists arrive from data-* attributes and may carry escaped
+unicode sequences or legacy shapes (dicts, JSON strings). They are cleaned once
+on write so read paths can use the stored values as-is.
+"""
+import json
+from typing import Any, List
+
+
+def decode_unicode_escapes(value: Any) -> Any:
+    """Decode strings that contain unicode escape sequences like \\u002D.
+
+    Uses json.loads on a quoted string to safely decode common escape sequences
+    without over-decoding regular text. Every JSON escape is decoded, so a
+    literal ``\\n`` or ``\\t`` becomes a real newline or tab. Strings whose
+    backslashes are not valid JSON escapes, and non-strings, are returned
+    unchanged.
+    """
+    if isinstance(value, str) and "\\" in value:
+        try:
+            # Quote for a JSON string literal; backslashes are left alone so
+            # json.loads can decode the escapes
+            s = value.replace('"', '\\"')
+            return json.loads(f'"{s}"')
+        except Exception:
+            return value
+    return value
+
+
+def normalize_artists(value: Any) -> List[str]:
+    """Return artists as a flat list of decoded names.
+
+    Accepts the shapes older rows were stored in: a list of names, a list of
+    ``{"name": ...}`` dicts, a single dict, a plain string or a JSON-encoded list.
+    """
+    if not value:
+        return []
+    if isinstance(value, str):
+        if value.startswith('['):
+            try:
+                return normalize_artists(json.loads(value))
+            except ValueError:
+                pass
+        return [decode_unicode_escapes(value)]
+    if isinstance(value, dict):
+        value = [value]
+    if not isinstance(value, list):
+        return [str(value)]
+
+    names = []
+    for artist in value:
+        if isinstance(artist, dict):
+            artist = artist.get('name', 'Unknown')
+        names.append(decode_unicode_escapes(artist if isinstance(artist, str) else str(artist)))
+    return names
+
+
+def format_artists(artists: Any) -> str:
+    """Join stored artists for display, 'Unknown' when there are none.
+
+    Rows written before normalization (or not yet backfilled by
+    normalize_decisions) may still hold a legacy shape; those are normalized
+    here rather than trusted.
+    """
+    if not isinstance(artists, list) or not all(isinstance(a, str) for a in artists):
+        artists = normalize_artists(artists)
+    return ', '.join(artists) if artists else 'Unknown'
+
+
+def artist_key(name: str) -> str:
+    """Normalized form of an artist name used for indexed lookups."""
+    return ' '.join(name.casefold().split())
@@ -1,3 +1,84 @@
-from django.test import TestCase
+import random
+from collections import Counter
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from .analytics import LibraryBuilder
+from .models import KeptSong
+from .normalize import decode_unicode_escapes, format_artists, normalize_artists
+
+
+class DecodeUnicodeEscapesTests(SimpleTestCase):
+
+    def test_unicode_escapes_are_decoded(self):
+        self.assertEqual(decode_unicode_escapes('Jay\\u002DZ'), 'Jay-Z')
+        self.assertEqual(decode_unicode_escapes('Beyonc\\u00e9'), 'Beyoncé')
+
+    def test_control_escapes_become_control_characters(self):
+        # Any JSON escape is decoded, including a literal \n or \t in a name
+        self.assertEqual(decode_unicode_escapes('Line\\nBreak'), 'Line\nBreak')
+        self.assertEqual(decode_unicode_escapes('Tab\\tbed'), 'Tab\tbed')
+
+    def test_text_without_valid_escapes_is_unchanged(self):
+        for value in ('AC/DC', 'C:\\path', 'back\\slash', 'say "hi"'):
+            with self.subTest(value=value):
+                self.assertEqual(decode_unicode_escapes(value), value)
+
+    def test_quotes_next_to_escapes_survive(self):
+        self.assertEqual(decode_unicode_escapes('"Hi" \\u002D there'), '"Hi" - there')
+
+    def test_non_strings_are_returned_as_is(self):
+        for value in (None, 3, ['a\\u002Db']):
+            with self.subTest(value=value):
+                self.assertEqual(decode_unicode_escapes(value), value)
+
+
+class FormatArtistsTests(SimpleTestCase):
+
+    def test_normalized_lists_are_joined(self):
+        self.assertEqual(format_artists(['A', 'B']), 'A, B')
+        self.assertEqual(format_artists([]), 'Unknown')
+        self.assertEqual(format_artists(None), 'Unknown')
+
+    def test_legacy_shapes_are_normalized_on_read(self):
+        self.assertEqual(format_artists([{'name': 'X'}, {'name': 'Y'}]), 'X, Y')
+        self.assertEqual(format_artists({'name': 'X'}), 'X')
+        self.assertEqual(format_artists('["A", "B"]'), 'A, B')
+        self.assertEqual(format_artists('Solo'), 'Solo')
+        self.assertEqual(normalize_artists([{'no_name': 1}]), ['Unknown'])
+
+
+class LegacyDecisionExportTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='alice')
+        self.client.force_login(self.user)
+        song, _ = KeptSong.record_decision(self.user, 'p1', 'spotify:track:1', name='Song', artists=['A'], kept=True)
+        # A row stored before normalization, never backfilled
+        KeptSong.objects.filter(pk=song.pk).update(artists=[{'name': 'Legacy Artist'}])
+
+    def test_decision_export_streams_legacy_rows(self):
+        response = self.client.get(reverse('playlists.export_csv', args=['decisions']))
+        body = b''.join(response.streaming_content).decode()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Song,Legacy Artist,Kept', body)
+
+
+class LibraryColumnsTests(SimpleTestCase):
+
+    def test_top_artists_match_counter_most_common(self):
+        rng = random.Random(34)
+        for _ in range(200):
+            items = [
+                {'track': {'artists': [{'name': f'artist {rng.randint(0, 15)}'} for _ in range(rng.randint(0, 3))]}}
+                for _ in range(rng.randint(0, 60))
+            ]
+            builder = LibraryBuilder()
+            builder.add_items(items)
+            columns = builder.build()
+            names = Counter(a['name'] for item in items for a in item['track']['artists'])
+            for k in (None, 1, 5, 20):
+                with self.subTest(k=k):
+                    self.assertEqual(columns.top_artists(k), names.most_common(k))
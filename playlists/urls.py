@@ -4,6 +4,7 @@ from . import views
 urlpatterns = [
     path("", views.playlist_dashboard, name="playlists.dashboard"),
     path("analytics/", views.analytics_dashboard, name="playlists.analytics"),
+    path("analytics/events/", views.analytics_events, name="playlists.analytics_events"),
     path("analytics/export/<str:section>/", views.export_analytics_csv, name="playlists.export_csv"),
     path("edit/", views.render_edit, name="playlists.edit"),
     path("<str:playlist_id>/edit/", views.render_edit, name="playlists.edit_by_id"),
@@ -1,37 +1,35 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
+from accounts.admission import heavy
+from accounts.cache import ANALYTICS, USER_PLAYLISTS
+from accounts.dispatch import Priority, prioritized
+from accounts.replica import reporting, stick_to_primary
 from accounts.spotify import get_user_playlists, get_playlist_tracks, get_playlist, remove_tracks_from_playlist, get_spotify_user_profile
 import requests # type: ignore
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 import json
-from .models import KeptSong
+from .models import KeptSong, PlaylistMeta, Artist
+from .analytics import LibraryBuilder, get_snapshot_items, load_library
+from .normalize import decode_unicode_escapes, normalize_artists, format_artists
+from .csv_stream import streaming_csv_response
+from .event_stream import ProgressThrottle, event_stream_response, sse_event
 from django.views.decorators.http import require_POST
 from django.contrib.auth import get_user_model
 from django.shortcuts import get_object_or_404
+from django.db.models import Count, Q
+from django.conf import settings
 from typing import Any, List
 
 
-def _decode_unicode_escapes(value: Any) -> Any:
-    """Decode strings that contain unicode escape sequences like \u002D.
+def invalidate_analytics_cache(user) -> None:
+    """Drop the cached analytics for a user so the next visit recomputes them.
 
-    Uses json.loads on a quoted string to safely decode common escape sequences
-    without over-decoding regular text. Non-strings are returned unchanged.
+    The recompute must see the write that got us here, so the user's reporting
+    reads are also pinned to the primary database for a while.
     """
-    if isinstance(value, str) and "\\" in value:
-        try:
-            # Quote and escape for JSON string literal
-            s = value.replace("\\", "\\\\").replace('"', '\\"')
-            return json.loads(f'"{s}"')
-        except Exception:
-            return value
-    return value
-
-
-def _decode_list(lst: Any) -> Any:
-    if isinstance(lst, list):
-        return [_decode_unicode_escapes(x) for x in lst]
-    return lst
+    ANALYTICS.invalidate(user)
+    stick_to_primary(user)
 
 
 @login_required
@@ -39,17 +37,22 @@ def playlist_dashboard(request):
     """Fetch the user's playlists from Spotify and render them."""
     try:
         data = get_user_playlists(request.user)
-        playlists = data.get("items", [])
+        # Cached objects are shared with other requests; patch copies only
+        playlists = list(data.get("items", []))
+        PlaylistMeta.record(playlists)
         
         # Only fetch fresh count for recently modified playlist (stored in session)
         modified_playlist_id = request.session.get('modified_playlist_id')
         if modified_playlist_id:
-            for playlist in playlists:
+            for i, playlist in enumerate(playlists):
                 if playlist['id'] == modified_playlist_id:
                     try:
                         fresh_data = get_playlist(request.user, playlist['id'])
                         if fresh_data and 'tracks' in fresh_data:
-                            playlist['tracks']['total'] = fresh_data['tracks']['total']
+                            playlists[i] = {
+                                **playlist,
+                                'tracks': {**playlist['tracks'], 'total': fresh_data['tracks']['total']},
+                            }
                     except Exception:
                         pass
                     break
@@ -64,7 +67,11 @@ def playlist_dashboard(request):
             "playlists/dashboard.html",
             {"error_message": error_message, "playlists": playlists},
         )
-    return render(request, "playlists/dashboard.html", {"playlists": playlists})
+    return render(request, "playlists/dashboard.html", {
+        "playlists": playlists,
+        # Set while a past-TTL copy is shown and refreshed in the background
+        "stale_since": USER_PLAYLISTS.stale_since(user=request.user),
+    })
 
 
 @login_required
@@ -79,15 +86,18 @@ def render_edit(request, playlist_id=None):
 
     # find requested playlist by id if given (fetch directly to avoid first-page issues)
     playlist = None
+    fetched = []
     if playlist_id:
         try:
             playlist = get_playlist(request.user, playlist_id)
+            fetched = [playlist]
         except requests.RequestException:
             # Fallback to scanning the first page, in case of transient error
             for p in playlists:
                 if str(p.get("id")) == str(playlist_id):
                     playlist = p
                     break
+    PlaylistMeta.record([*playlists, *fetched])
 
     # default to first playlist
     if not playlist:
@@ -107,6 +117,7 @@ def render_edit(request, playlist_id=None):
                 playlist_id=playlist["id"], 
                 kept=True
             ).delete()
+            invalidate_analytics_cache(request.user)
         except Exception:
             pass
         # Redirect to same page without show_all parameter to show fresh start
@@ -187,22 +198,21 @@ def save_decision(request):
     if not all([playlist_id, track_uri]) or kept is None:
         return JsonResponse({"error": "missing_fields"}, status=400)
 
-    # Normalize any escaped unicode sequences that may have come from data-* attributes
-    name = _decode_unicode_escapes(name or "")
-    artists = _decode_list(artists or [])
-
-    # Upsert the decision
-    obj, created = KeptSong.objects.update_or_create(
-        user=user, playlist_id=playlist_id, track_uri=track_uri,
-        defaults={
-            "name": name,
-            "artists": artists,
-            "image_url": image_url,
-            "preview_url": preview_url,
-            "spotify_url": spotify_url,
-            "kept": bool(kept),
-        },
+    # Normalize once on write (escaped unicode from data-* attributes, legacy
+    # artist shapes) so every read path can use the stored values directly
+    name = decode_unicode_escapes(name or "")
+    artists = normalize_artists(artists)
+
+    _, created = KeptSong.record_decision(
+        user, playlist_id, track_uri,
+        name=name,
+        artists=artists,
+        image_url=image_url,
+        preview_url=preview_url,
+        spotify_url=spotify_url,
+        kept=bool(kept),
     )
+    invalidate_analytics_cache(user)
 
     return JsonResponse({"status": "saved", "created": created})
 
@@ -214,8 +224,8 @@ def kept_view(request, playlist_id):
     qs = KeptSong.objects.filter(user=request.user, playlist_id=playlist_id).order_by('-created_at')
     kept = [
         {
-            "name": _decode_unicode_escapes(s.name),
-            "artists": _decode_list(s.artists or []),
+            "name": s.name,
+            "artists": s.artists or [],
             "image_url": s.image_url,
             "preview_url": s.preview_url,
             "spotify_url": s.spotify_url,
@@ -226,8 +236,8 @@ def kept_view(request, playlist_id):
 
     removed = [
         {
-            "name": _decode_unicode_escapes(s.name),
-            "artists": _decode_list(s.artists or []),
+            "name": s.name,
+            "artists": s.artists or [],
             "image_url": s.image_url,
             "preview_url": s.preview_url,
             "spotify_url": s.spotify_url,
@@ -272,12 +282,7 @@ def apply_playlist_changes(request, playlist_id):
         request.session['modified_playlist_id'] = playlist_id
         
         # Invalidate analytics cache since playlist data changed
-        cache_key = f'analytics_data_{request.user.id}'
-        cache_time_key = f'analytics_cache_time_{request.user.id}'
-        if cache_key in request.session:
-            del request.session[cache_key]
-        if cache_time_key in request.session:
-            del request.session[cache_time_key]
+        invalidate_analytics_cache(request.user)
         
         return JsonResponse({
             'status': 'success',
@@ -323,6 +328,7 @@ def reconsider_decision(request):
 
     obj.kept = True
     obj.save(update_fields=["kept"])
+    invalidate_analytics_cache(request.user)
 
     return JsonResponse({"status": "updated", "kept": True})
 
@@ -1742,285 +1748,357 @@ def get_playlist_tracks_with_previews(user, playlist_id):
 ]
 
 
-@login_required
-def analytics_dashboard(request):
-    """Display comprehensive music analytics."""
-    from collections import Counter, defaultdict
+def _library_stats(playlists, library) -> dict:
+    """Stats cards and top artists for a (possibly partial) library scan."""
+    total_duration_ms = library.total_duration_ms()
+    
+    # Top Artists distribution
+    top_artists_data = []
+    total_artist_count = len(library.artist_codes)
+    for artist, count in library.top_artists(10):
+        if total_artist_count > 0:
+            percentage = round((count / total_artist_count) * 100, 1)
+            top_artists_data.append({
+                'name': artist,
+                'count': count,
+                'percentage': percentage
+            })
+    
+    return {
+        'stats': {
+            'total_playlists': len(playlists),
+            'total_tracks': library.track_count,
+            'total_hours': total_duration_ms // (1000 * 60 * 60),
+            'total_minutes': (total_duration_ms % (1000 * 60 * 60)) // (1000 * 60),
+            'unique_artists': library.unique_artists
+        },
+        'top_artists_data': top_artists_data,
+    }
+
+
+def _decision_context(user) -> dict:
+    """Decision history sections of the analytics page (database only)."""
+    decisions = KeptSong.objects.filter(user=user).order_by('-created_at')
+    kept_count = decisions.filter(kept=True).count()
+    removed_count = decisions.filter(kept=False).count()
+    total_decisions = kept_count + removed_count
+    
+    kept_percentage = round((kept_count / total_decisions) * 100, 1) if total_decisions > 0 else 0
+    removed_percentage = round((removed_count / total_decisions) * 100, 1) if total_decisions > 0 else 0
+    
+    recent_decisions = []
+    for decision in decisions[:50]:
+        recent_decisions.append({
+            'name': decision.name,
+            'artist': format_artists(decision.artists),
+            'kept': decision.kept,
+            'date': decision.created_at.strftime('%Y-%m-%d %H:%M')
+        })
+    
+    # Per-artist decision stats straight from the artist index
+    artist_decisions = (
+        Artist.objects.filter(song_links__kept_song__user=user)
+        .annotate(
+            kept=Count('song_links', filter=Q(song_links__kept_song__kept=True)),
+            removed=Count('song_links', filter=Q(song_links__kept_song__kept=False)),
+        )
+        .order_by('-removed', '-kept', 'name')[:10]
+    )
+    artist_decision_stats = [
+        {'name': a.name, 'kept': a.kept, 'removed': a.removed}
+        for a in artist_decisions
+    ]
+    
+    return {
+        'decision_stats': {
+            'kept_count': kept_count,
+            'removed_count': removed_count,
+            'kept_percentage': kept_percentage,
+            'removed_percentage': removed_percentage
+        },
+        'recent_decisions': recent_decisions,
+        'artist_decision_stats': artist_decision_stats
+    }
+
+
+def _analytics_events(user):
+    """Scan the user's own playlists one by one, pushing partial stats.
+
+    Emits "start", "progress" events with the stats so far as playlists are
+    scanned (at most one per STREAM_PROGRESS_INTERVAL), and "done" once the
+    full context is cached (or "error"). The page reloads on "done" and is
+    then served from the cache.
+    """
     from datetime import datetime
     
     try:
-        # Check for cached analytics data
-        cache_key = f'analytics_data_{request.user.id}'
-        cache_time_key = f'analytics_cache_time_{request.user.id}'
-        
-        # Allow force refresh with ?refresh=1 parameter
-        force_refresh = request.GET.get('refresh') == '1'
-        
-        if not force_refresh:
-            cached_data = request.session.get(cache_key)
-            cached_time = request.session.get(cache_time_key)
-            
-            # Use cache if it exists and is less than 24 hours old (86400 seconds)
-            if cached_data and cached_time:
-                cache_age = datetime.now().timestamp() - cached_time
-                if cache_age < 86400:  # 24 hour cache
-                    # Create a copy to avoid modifying session data
-                    context = cached_data.copy()
-                    cache_age_minutes = int(cache_age / 60)
-                    cache_age_hours = cache_age_minutes // 60
-                    remaining_minutes = cache_age_minutes % 60
-                    context['cache_age_minutes'] = cache_age_minutes
-                    context['cache_age_hours'] = cache_age_hours
-                    context['cache_remaining_minutes'] = remaining_minutes
-                    return render(request, 'playlists/analytics.html', context)
-        
-        # Get all playlists
-        data = get_user_playlists(request.user)
+        data = get_user_playlists(user)
         playlists = data.get("items", [])
+        PlaylistMeta.record(playlists)
         
         # Filter to only user's own playlists for faster analytics
-        user_profile = get_spotify_user_profile(request.user)
-        user_spotify_id = user_profile.get('id')
+        user_spotify_id = get_spotify_user_profile(user).get('id')
         owned_playlists = [p for p in playlists if p['owner']['id'] == user_spotify_id]
+    except Exception as e:
+        yield sse_event('error', {'error': f'Failed to load analytics: {e}'})
+        return
+    
+    yield sse_event('start', {'total': len(owned_playlists)})
+    
+    # Fold tracks in playlist by playlist, as load_library does
+    builder = LibraryBuilder()
+    throttle = ProgressThrottle()
+    for done, playlist in enumerate(owned_playlists, start=1):
+        try:
+            builder.add_items(get_snapshot_items(user, playlist))
+        except Exception:
+            pass  # Playlists that fail to load are skipped
+        if not throttle.due():
+            continue
+        progress = _library_stats(playlists, builder.build())
+        progress.update(done=done, total=len(owned_playlists), playlist=playlist.get('name'))
+        yield sse_event('progress', progress)
+    
+    context = _library_stats(playlists, builder.build())
+    # Largest playlists
+    context['largest_playlists'] = sorted(
+        [{'name': p['name'], 'track_count': p['tracks']['total'], 
+          'owner': p['owner'].get('display_name', 'Unknown'), 'id': p['id']} 
+         for p in playlists],
+        key=lambda x: x['track_count'],
+        reverse=True
+    )[:10]
+    context.update(_decision_context(user))
+    
+    # Cache the analytics data (24 hours by default)
+    ANALYTICS.set(value={'context': context, 'cached_at': datetime.now().timestamp()}, user=user)
+    yield sse_event('done', {})
+
+
+@login_required
+@reporting
+def analytics_dashboard(request):
+    """Display comprehensive music analytics.
+
+    Served from the analytics cache when possible. Otherwise the page renders
+    straight away with the decision history and fills in the library stats
+    from analytics_events as each playlist is scanned.
+    """
+    from datetime import datetime
+    
+    # Allow force refresh with ?refresh=1 parameter
+    force_refresh = request.GET.get('refresh') == '1'
+    
+    if not force_refresh:
+        cached = ANALYTICS.get(user=request.user)
         
-        # Initialize counters
-        total_tracks = 0
-        total_duration_ms = 0
-        all_artists = []
-        
-        # Get all tracks from owned playlists only
-        for playlist in owned_playlists:
-            try:
-                tracks = get_playlist_tracks(request.user, playlist['id'])
-                for item in tracks:
-                    track = item.get('track')
-                    if not track:
-                        continue
-                    
-                    total_tracks += 1
-                    
-                    # Duration
-                    duration = track.get('duration_ms', 0)
-                    total_duration_ms += duration
-                    
-                    # Artists
-                    artists = track.get('artists', [])
-                    for artist in artists:
-                        all_artists.append(artist.get('name', 'Unknown'))
-            except Exception as e:
-                continue
-        
-        # Calculate stats
-        total_hours = total_duration_ms // (1000 * 60 * 60)
-        total_minutes = (total_duration_ms % (1000 * 60 * 60)) // (1000 * 60)
-        
-        # Top Artists distribution
-        artist_counts = Counter(all_artists)
-        top_artists = artist_counts.most_common(20)
-        
-        top_artists_data = []
-        total_artist_count = sum(artist_counts.values())
-        for artist, count in top_artists[:10]:
-            if total_artist_count > 0:
-                percentage = round((count / total_artist_count) * 100, 1)
-                top_artists_data.append({
-                    'name': artist,
-                    'count': count,
-                    'percentage': percentage
-                })
-        
-        # Largest playlists
-        largest_playlists = sorted(
-            [{'name': p['name'], 'track_count': p['tracks']['total'], 
-              'owner': p['owner'].get('display_name', 'Unknown'), 'id': p['id']} 
-             for p in playlists],
-            key=lambda x: x['track_count'],
-            reverse=True
-        )[:10]
-        
-        # Decision history from KeptSong model
-        decisions = KeptSong.objects.filter(user=request.user).order_by('-created_at')
-        kept_count = decisions.filter(kept=True).count()
-        removed_count = decisions.filter(kept=False).count()
-        total_decisions = kept_count + removed_count
-        
-        kept_percentage = round((kept_count / total_decisions) * 100, 1) if total_decisions > 0 else 0
-        removed_percentage = round((removed_count / total_decisions) * 100, 1) if total_decisions > 0 else 0
-        
-        recent_decisions = []
-        for decision in decisions[:50]:
-            artist_list = decision.artists if isinstance(decision.artists, list) else []
-            artist_str = ', '.join([a if isinstance(a, str) else a.get('name', 'Unknown') 
-                                   for a in artist_list]) if artist_list else 'Unknown'
-            
-            recent_decisions.append({
-                'name': decision.name,
-                'artist': artist_str,
-                'kept': decision.kept,
-                'date': decision.created_at.strftime('%Y-%m-%d %H:%M')
-            })
-        
-        context = {
-            'stats': {
-                'total_playlists': len(playlists),
-                'total_tracks': total_tracks,
-                'total_hours': total_hours,
-                'total_minutes': total_minutes,
-                'unique_artists': len(set(all_artists))
-            },
-            'top_artists_data': top_artists_data,
-            'largest_playlists': largest_playlists,
-            'decision_stats': {
-                'kept_count': kept_count,
-                'removed_count': removed_count,
-                'kept_percentage': kept_percentage,
-                'removed_percentage': removed_percentage
-            },
-            'recent_decisions': recent_decisions
-        }
-        
-        # Cache the analytics data for 24 hours
-        request.session[cache_key] = context
-        request.session[cache_time_key] = datetime.now().timestamp()
-        
-        return render(request, 'playlists/analytics.html', context)
-        
+        # Entries expire from the cache backend after ANALYTICS_CACHE_TIMEOUT
+        if cached:
+            cache_age = datetime.now().timestamp() - cached['cached_at']
+            if cache_age < settings.ANALYTICS_CACHE_TIMEOUT:
+                # Create a copy so the badge fields never leak into the cache
+                context = cached['context'].copy()
+                cache_age_minutes = int(cache_age / 60)
+                cache_age_hours = cache_age_minutes // 60
+                remaining_minutes = cache_age_minutes % 60
+                context['cache_age_minutes'] = cache_age_minutes
+                context['cache_age_hours'] = cache_age_hours
+                context['cache_remaining_minutes'] = remaining_minutes
+                return render(request, 'playlists/analytics.html', context)
+    
+    try:
+        context = _decision_context(request.user)
     except Exception as e:
         return render(request, 'playlists/analytics.html', {
             'error_message': f'Failed to load analytics: {str(e)}'
         })
+    context['live_scan'] = True
+    return render(request, 'playlists/analytics.html', context)
 
 
+@heavy
 @login_required
-def export_analytics_csv(request, section):
-    """Export analytics data as CSV."""
+@reporting
+def analytics_events(request):
+    """Server-sent events for the analytics library scan (see _analytics_events)."""
+    return event_stream_response(request, prioritized(_analytics_events(request.user), Priority.BULK))
+
+
+# Rows fetched per database round trip when streaming decision exports
+EXPORT_CHUNK_SIZE = 2000
+
+# Export sections computed from the user's Spotify library rather than the DB
+SPOTIFY_EXPORT_SECTIONS = ('genres', 'playlists', 'popular', 'years')
+
+# Sections that need every track of every playlist (one library scan)
+LIBRARY_EXPORT_SECTIONS = ('genres', 'popular', 'years')
+
+# Order of sections in an "export everything" bundle: the cheap ones first so
+# the download starts before the library scan
+BUNDLE_EXPORT_SECTIONS = ('playlists', 'decisions', 'genres', 'popular', 'years')
+
+
+def _analytics_csv_rows(user, section, playlists, library=None):
+    """Yield the CSV rows of an analytics export section, header first.
+
+    Library-backed sections fold tracks in playlist by playlist, so only the
+    compact columns are held in memory; decisions are read in chunks. Pass a
+    prebuilt ``library`` to share one scan between sections.
+    """
+    if section == 'genres':
+        # Export genre/artist distribution
+        yield ['Artist', 'Track Count']
+        if library is None:
+            library = load_library(user, playlists)
+        for artist, count in library.top_artists():
+            yield [artist, count]
+
+    elif section == 'playlists':
+        # Export playlist data
+        yield ['Playlist Name', 'Track Count', 'Owner']
+        for p in sorted(playlists, key=lambda x: x['tracks']['total'], reverse=True):
+            yield [
+                p['name'],
+                p['tracks']['total'],
+                p['owner'].get('display_name', 'Unknown')
+            ]
+
+    elif section == 'popular':
+        # Export popular tracks
+        yield ['Track Name', 'Artist', 'Popularity']
+        if library is None:
+            library = load_library(user, playlists, keep_track_names=True)
+        for i in library.popularity_ranking():
+            yield [
+                library.track_names[i],
+                ', '.join(library.track_artists(i)),
+                int(library.popularity[i])
+            ]
+
+    elif section == 'years':
+        # Export release year distribution
+        yield ['Decade', 'Track Count']
+        if library is None:
+            library = load_library(user, playlists)
+        for decade, count in library.decade_histogram():
+            yield [f"{decade}s", count]
+
+    elif section == 'decisions':
+        # Export decision history
+        yield ['Track Name', 'Artist', 'Decision', 'Date', 'Playlist ID']
+        decisions = (
+            KeptSong.objects.filter(user=user)
+            .order_by('-created_at')
+            .values_list('name', 'artists', 'kept', 'created_at', 'playlist_id')
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        )
+        for name, artists, kept, created_at, playlist_id in decisions:
+            yield [
+                name,
+                format_artists(artists),
+                'Kept' if kept else 'Removed',
+                created_at.strftime('%Y-%m-%d %H:%M:%S'),
+                playlist_id
+            ]
+
+
+def _bundle_sections(user, playlists):
+    """Yield (section, rows) for every export section from a single library scan."""
+    library = None
+    for section in BUNDLE_EXPORT_SECTIONS:
+        if section in LIBRARY_EXPORT_SECTIONS and library is None:
+            library = load_library(user, playlists, keep_track_names=True)
+        yield section, _analytics_csv_rows(user, section, playlists, library)
+
+
+class _ZipBuffer:
+    """Unseekable write target that lets a ZipFile be drained while it is built."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _zip_bundle(sections):
+    """Stream a zip archive holding one CSV per export section."""
     import csv
-    from collections import Counter
+    import io
+    import zipfile
+
+    buffer = _ZipBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for section, rows in sections:
+            with archive.open(f"{section}.csv", 'w', force_zip64=True) as entry:
+                text = io.TextIOWrapper(entry, encoding='utf-8', newline='')
+                writer = csv.writer(text)
+                for row in rows:
+                    writer.writerow(row)
+                    if buffer._chunks:
+                        yield buffer.drain()
+                text.flush()
+                text.detach()
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+def _zstd_bundle(sections):
+    """Stream a zstd-compressed JSONL bundle: one {"section", "row"} object per line."""
+    import zstandard
+
+    compressor = zstandard.ZstdCompressor().compressobj()
+    for section, rows in sections:
+        for row in rows:
+            line = json.dumps({'section': section, 'row': row}, default=str) + '\n'
+            yield compressor.compress(line.encode('utf-8'))
+    yield compressor.flush()
+
+
+@heavy
+@login_required
+@reporting
+def export_analytics_csv(request, section):
+    """Export analytics data as a streamed CSV download.
+
+    ``section='all'`` bundles every section from one library scan, as a zip of
+    CSVs or, with ``?format=zstd``, a zstd-compressed JSONL file.
+    """
     from datetime import datetime
     
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="cleanbeats_{section}_{datetime.now().strftime("%Y%m%d")}.csv"'
-    writer = csv.writer(response)
-    
     try:
-        if section == 'genres':
-            # Export genre/artist distribution
-            data = get_user_playlists(request.user)
-            playlists = data.get("items", [])
-            all_artists = []
-            
-            for playlist in playlists:
-                try:
-                    tracks = get_playlist_tracks(request.user, playlist['id'])
-                    for item in tracks:
-                        track = item.get('track')
-                        if not track:
-                            continue
-                        artists = track.get('artists', [])
-                        for artist in artists:
-                            all_artists.append(artist.get('name', 'Unknown'))
-                except:
-                    continue
-            
-            artist_counts = Counter(all_artists)
-            writer.writerow(['Artist', 'Track Count'])
-            for artist, count in artist_counts.most_common():
-                writer.writerow([artist, count])
-        
-        elif section == 'playlists':
-            # Export playlist data
-            data = get_user_playlists(request.user)
-            playlists = data.get("items", [])
-            
-            writer.writerow(['Playlist Name', 'Track Count', 'Owner'])
-            for p in sorted(playlists, key=lambda x: x['tracks']['total'], reverse=True):
-                writer.writerow([
-                    p['name'],
-                    p['tracks']['total'],
-                    p['owner'].get('display_name', 'Unknown')
-                ])
-        
-        elif section == 'popular':
-            # Export popular tracks
-            data = get_user_playlists(request.user)
-            playlists = data.get("items", [])
-            popular_tracks = []
-            
-            for playlist in playlists:
-                try:
-                    tracks = get_playlist_tracks(request.user, playlist['id'])
-                    for item in tracks:
-                        track = item.get('track')
-                        if not track:
-                            continue
-                        artists = track.get('artists', [])
-                        artist_names = ', '.join([a.get('name', 'Unknown') for a in artists])
-                        popular_tracks.append({
-                            'name': track.get('name', 'Unknown'),
-                            'artist': artist_names,
-                            'popularity': track.get('popularity', 0)
-                        })
-                except:
-                    continue
-            
-            writer.writerow(['Track Name', 'Artist', 'Popularity'])
-            for track in sorted(popular_tracks, key=lambda x: x['popularity'], reverse=True):
-                writer.writerow([track['name'], track['artist'], track['popularity']])
-        
-        elif section == 'years':
-            # Export release year distribution
-            data = get_user_playlists(request.user)
-            playlists = data.get("items", [])
-            release_years = []
-            
-            for playlist in playlists:
-                try:
-                    tracks = get_playlist_tracks(request.user, playlist['id'])
-                    for item in tracks:
-                        track = item.get('track')
-                        if not track:
-                            continue
-                        album = track.get('album', {})
-                        release_date = album.get('release_date', '')
-                        if release_date:
-                            try:
-                                year = int(release_date.split('-')[0])
-                                release_years.append(year)
-                            except (ValueError, IndexError):
-                                pass
-                except:
-                    continue
-            
-            year_counter = Counter()
-            for year in release_years:
-                decade = (year // 10) * 10
-                year_counter[decade] += 1
-            
-            writer.writerow(['Decade', 'Track Count'])
-            for decade in sorted(year_counter.keys(), reverse=True):
-                writer.writerow([f"{decade}s", year_counter[decade]])
-        
-        elif section == 'decisions':
-            # Export decision history
-            decisions = KeptSong.objects.filter(user=request.user).order_by('-created_at')
-            
-            writer.writerow(['Track Name', 'Artist', 'Decision', 'Date', 'Playlist ID'])
-            for decision in decisions:
-                artist_list = decision.artists if isinstance(decision.artists, list) else []
-                artist_str = ', '.join([a if isinstance(a, str) else a.get('name', 'Unknown') 
-                                       for a in artist_list]) if artist_list else 'Unknown'
-                
-                writer.writerow([
-                    decision.name,
-                    artist_str,
-                    'Kept' if decision.kept else 'Removed',
-                    decision.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                    decision.playlist_id
-                ])
-        
-        return response
-        
+        # Fetch the playlist list up front so auth/rate-limit failures still
+        # surface as an error response instead of a truncated download
+        playlists = []
+        if section in SPOTIFY_EXPORT_SECTIONS or section == 'all':
+            playlists = get_user_playlists(request.user).get("items", [])
+            PlaylistMeta.record(playlists)
     except Exception as e:
         response = HttpResponse(f'Error exporting data: {str(e)}')
         response.status_code = 500
         return response
+    
+    stamp = datetime.now().strftime("%Y%m%d")
+    if section == 'all':
+        sections = _bundle_sections(request.user, playlists)
+        if request.GET.get('format') == 'zstd':
+            response = StreamingHttpResponse(prioritized(_zstd_bundle(sections), Priority.BULK), content_type='application/zstd')
+            response['Content-Disposition'] = f'attachment; filename="cleanbeats_all_{stamp}.jsonl.zst"'
+        else:
+            response = StreamingHttpResponse(prioritized(_zip_bundle(sections), Priority.BULK), content_type='application/zip')
+            response['Content-Disposition'] = f'attachment; filename="cleanbeats_all_{stamp}.zip"'
+        return response
+    
+    return streaming_csv_response(
+        prioritized(_analytics_csv_rows(request.user, section, playlists), Priority.BULK),
+        f"cleanbeats_{section}_{stamp}.csv",
+    )